@@ -1,5 +1,9 @@
+import hashlib
+import json
+import os
 import plotly.graph_objects as go
 import pandas as pd
+from pandas.api.types import union_categoricals
 from sankey import make_sankey
 '''
 Emma Penn
@@ -9,12 +13,36 @@ September 25, 2024
 Description: Python File For Generating Visualizations for Artists in the Museum of Contemporary Art In Chicago
 '''
 
+# the columns of artists.json the visualizations use
+COLUMNS = ["ArtistBio", "Nationality", "Gender", "DisplayName"]
+
+# bump when load_artists or clean_bio change what they produce, to rebuild existing caches
+CACHE_VERSION = 1
+
 
 def clean_bio(df, variable, num, new_name):
     '''
     Takes in the dataframe, the column name to clean, a number, and the new name to store the variable.
     Will take in as many digits as specified by the num parameter and store it in a new column using the new_name.
-    Returns a new dataframe with the cleaned, new column.
+    The last of those digits is set to 0, so "American, born 1941" gives the decade "1940".
+    Rows with fewer than num digits get 0.
+    Returns the dataframe with the cleaned, new column.
+
+    Works on the whole column at once with the pandas string methods; same results as _clean_bio_loop,
+    except that rows with exactly num - 1 digits get 0 instead of raising IndexError.
+    '''
+
+    digits = df[variable].str.replace(r"\D+", "", regex=True)
+    decades = (digits.str[:num - 1] + "0").astype(object)
+    decades[~(digits.str.len() >= num)] = 0
+    df[new_name] = decades
+
+    return df
+
+def _clean_bio_loop(df, variable, num, new_name):
+    '''
+    The original, row by row version of clean_bio, kept to check the vectorized version against.
+    Replaces the variable column with lists of its characters.
 
     '''
 
@@ -36,6 +64,151 @@ def clean_bio(df, variable, num, new_name):
 
     return df
 
+def iter_records(path, block_size=1 << 20):
+    '''
+    Yields the records of a JSON file one at a time, reading block_size characters at a time.
+    The file is either a JSON array of objects, like artists.json, or JSON lines (one object per line).
+    '''
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8-sig") as file:
+        buffer = file.read(block_size).lstrip()
+        is_array = buffer.startswith("[")
+        pos = 1 if is_array else 0
+        while True:
+            # skip the whitespace and commas between records
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if is_array and buffer[pos:pos + 1] == "]":
+                return
+            if pos == len(buffer):
+                buffer, pos = file.read(block_size), 0
+                if not buffer:
+                    return
+                continue
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the record continues in the next block
+                more = file.read(block_size)
+                if not more:
+                    raise
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield record
+            pos = end
+
+
+def _clean_chunk(records):
+    '''
+    Takes in a list of artist records and returns the rows main() plots: with an artist bio, a birth decade,
+    a nationality and a gender, as categorical Nationality, Gender, Decade and DisplayName columns.
+    '''
+    chunk = pd.DataFrame.from_records([[record.get(column) for column in COLUMNS] for record in records],
+                                      columns=COLUMNS)
+    chunk = chunk[chunk["ArtistBio"].notna() & chunk["Nationality"].notna() & chunk["Gender"].notna()]
+    chunk = clean_bio(chunk.copy(), "ArtistBio", 4, "Decade")
+    chunk = chunk[chunk["Decade"] != 0].drop(columns="ArtistBio")
+    return chunk.astype("category")
+
+def load_artists(path, chunk_size=10000):
+    '''
+    Takes in the path of an artists JSON array or JSON lines file and a chunk size.
+    Streams the file chunk_size records at a time, keeping only the ArtistBio, Nationality, Gender and DisplayName
+    fields, and cleans every chunk as main() does: drops the rows without an artist bio, birth decade,
+    nationality or gender and stores the birth decade in a Decade column.
+    Returns one dataframe of categorical Nationality, Gender, DisplayName and Decade columns, so memory use grows with
+    the kept rows rather than with the size of the file.
+    '''
+    chunks = []
+    records = []
+    for record in iter_records(path):
+        records.append(record)
+        if len(records) == chunk_size:
+            chunks.append(_clean_chunk(records))
+            records = []
+    if records:
+        chunks.append(_clean_chunk(records))
+    # a chunk whose rows were all dropped has categories of another dtype, and adds nothing
+    chunks = [chunk for chunk in chunks if len(chunk)] or [_clean_chunk([])]
+
+    return pd.DataFrame({column: _union_columns([chunk[column] for chunk in chunks]) for column in chunks[0].columns})
+
+def _union_columns(columns):
+    '''
+    Takes in the categorical columns of the chunks and returns them as one categorical column.
+    A column that is all null has empty categories of the object dtype, so every column is first given the categories
+    dtype of the first column with categories.
+    '''
+    dtype = next((column.cat.categories.dtype for column in columns if len(column.cat.categories)),
+                 columns[0].cat.categories.dtype)
+    columns = [column if column.cat.categories.dtype == dtype else
+               column.cat.set_categories(column.cat.categories.astype(dtype)) for column in columns]
+    return union_categoricals(columns)
+
+def _sha256(path):
+    '''
+    Returns the sha256 hex digest of a file, read a block at a time.
+    '''
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def load_cached_artists(path, cache_path=None):
+    '''
+    Takes in the path of an artists JSON file and the path of a Parquet cache, by default the source path with a
+    .parquet extension.
+    Returns the same dataframe as load_artists, read from the cache if it was built from the current source file.
+    The cache stores the source's size, modification time and sha256 in its metadata: when the size and time match,
+    the cache is used as is; otherwise the source is hashed, a matching hash records the new size and time, and only a
+    different hash rebuilds the cache.
+    Needs pyarrow; without it the source is loaded every time.
+    '''
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return load_artists(path)
+
+    if cache_path is None:
+        cache_path = os.path.splitext(path)[0] + ".parquet"
+
+    stat = os.stat(path)
+    key = {"version": CACHE_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if os.path.exists(cache_path):
+        metadata = pq.read_schema(cache_path).metadata or {}
+        cached = json.loads(metadata.get(b"artists_source", b"{}"))
+        # an unchanged size and time skip hashing
+        if cached.get("version") == CACHE_VERSION and (cached.get("size"), cached.get("mtime_ns")) == \
+                (stat.st_size, stat.st_mtime_ns):
+            return pq.read_table(cache_path).to_pandas()
+        key["sha256"] = _sha256(path)
+        # a touched or copied but unchanged source still matches its hash: keep the data, record the new size and
+        # time so that the next load skips hashing again
+        if cached.get("version") == CACHE_VERSION and cached.get("sha256") == key["sha256"]:
+            table = pq.read_table(cache_path)
+            _write_cache(table, key, cache_path)
+            return table.to_pandas()
+    else:
+        key["sha256"] = _sha256(path)
+
+    df = load_artists(path)
+    _write_cache(pa.Table.from_pandas(df, preserve_index=False), key, cache_path)
+
+    return df
+
+def _write_cache(table, key, cache_path):
+    '''
+    Writes the table to the Parquet cache with the source key in its metadata
+    '''
+    import pyarrow.parquet as pq
+
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"artists_source": json.dumps(key).encode()})
+    # write next to the cache and rename, so an interrupted run never leaves a broken cache behind
+    pq.write_table(table, cache_path + ".tmp")
+    os.replace(cache_path + ".tmp", cache_path)
+
 def group_df(df, group_names, counts_name, threshold):
     '''
     Takes in a dataframe, a list of group_names, a counts name, and a threshold number.
@@ -43,7 +216,7 @@ def group_df(df, group_names, counts_name, threshold):
     column based on the groups from the groupby function and store in a new dataframe. Filters out all the counts_name
     which is below the specified threshold nubmer
     '''
-    new_group = df.groupby(group_names, as_index = False)[counts_name].nunique()
+    new_group = df.groupby(group_names, as_index = False, observed = True)[counts_name].nunique()
     new_group  = new_group[new_group[counts_name] > threshold]
 
     return new_group
@@ -52,19 +225,9 @@ def group_df(df, group_names, counts_name, threshold):
 
 
 def main():
-    # read in data
-    data = pd.read_json('artists.json')
-
-    # drop columns with no artist bio
-    data_selected = data[data["ArtistBio"].isna() == False]
-
-    # clean the artist bio column to only have the decade of artist's birth, stores the cleaned values in a new
-    # column called Decade
-    data_decade = clean_bio(data_selected, "ArtistBio", 4, "Decade")
-
-
-    # filter out all the rows which does not have an artist birth decade
-    data_decade = data_decade[data_decade["Decade"] != 0]
+    # read in the artists that have an artist bio, a nationality and a gender, with the decade of the artist's
+    # birth from the artist bio in a new column called Decade; cached in artists.parquet until artists.json changes
+    data_decade = load_cached_artists('artists.json')
 
 
 
@@ -73,11 +236,6 @@ def main():
     MAKING SANKEYS SPACE 
     '''
 
-    # filter out columns where there is no Nationality or Gender listed in their row
-    data_decade = data_decade[data_decade["Nationality"].isna() ==False]
-    data_decade = data_decade[data_decade["Gender"].isna() ==False]
-
-
     # Sankey Plot with Nationality on the left, Decade on the right, and links values being the Artist Name
     decades_sankeydf = group_df(data_decade, ["Nationality", "Decade"],"DisplayName", 25)
 
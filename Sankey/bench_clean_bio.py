@@ -0,0 +1,35 @@
+"""
+File: bench_clean_bio.py
+Description: Times the vectorized clean_bio against the original row by row
+version on the artists.json collection, repeated to the requested size.
+Run with: python bench_clean_bio.py [num_rows]
+
+"""
+
+import sys
+import time
+
+import pandas as pd
+
+from ArtistsData import clean_bio
+from ArtistsData import _clean_bio_loop
+
+
+def main():
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    data = pd.read_json("artists.json")
+    data = data[data["ArtistBio"].notna()]
+    data = pd.concat([data] * (num_rows // len(data) + 1), ignore_index=True).head(num_rows)
+
+    timings = {}
+    for name, function in [("vectorized", clean_bio), ("loop", _clean_bio_loop)]:
+        frame = data.copy()
+        start = time.perf_counter()
+        function(frame, "ArtistBio", 4, "Decade")
+        timings[name] = time.perf_counter() - start
+        print(f"{name:>10}: {timings[name]:.3f} s for {num_rows} rows")
+    print(f"   speedup: {timings['loop'] / timings['vectorized']:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,27 +5,22 @@ Modified By: Emma Penn
 
 """
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
-pd.set_option('future.no_silent_downcasting', True)
-
 
 def _code_mapping(df, src, targ):
-    """ Map labels in src and targ colums to integers """
-
-
-    # Get the distinct labels
-    labels = sorted(list(set(list(df[src]) + list(df[targ]))))
+    """ Map labels in src and targ colums to integers
+    The labels of both columns are factorized together, in sorted order, so a label gets the same code in either
+    column; missing labels get -1. Returns the dataframe with int32 codes in src and targ, and the list of labels """
 
-    # Create a label->code mapping
-    codes = range(len(labels))
-    lc_map = dict(zip(labels, codes))
+    codes, labels = pd.factorize(np.concatenate([df[src].to_numpy(dtype=object), df[targ].to_numpy(dtype=object)]),
+                                 sort=True)
+    codes = codes.astype(np.int32)
+    df = df.assign(**{src: codes[:len(df)], targ: codes[len(df):]})
 
-    # Substitute codes for labels in the dataframe
-    df = df.replace({src: lc_map, targ: lc_map})
-
-    return df, labels
+    return df, labels.tolist()
 
 def _stack(df, lst, val_col = None):
     '''
@@ -34,35 +29,55 @@ def _stack(df, lst, val_col = None):
     lst: list of columns you want to stack
     val_col: values column to stack (optional)
     gives back one big stacked dataframe
+    With a values column every adjacent pair of columns is grouped and counted as group_function does, but each
+    column is factorized a single time, the counting runs on integer codes and the pairs are concatenated once.
     '''
-    position = 2
-
-    if val_col:
-        original_df = group_function(df, [lst[0], lst[1]], counts_name=val_col)
-        original_df.columns = ["src", "targ", "val"]
-        while position < (len(lst)):
-            new_df = group_function(df, [lst[position - 1], lst[position]], counts_name=val_col)
-            new_df.columns = ["src", "targ", "val"]
-            original_df = pd.concat([original_df, new_df], axis=0)
-            position += 1
-
-    else:
-        original_df = df[[lst[0], lst[1]]]
-        original_df.columns = ["src", "targ"]
-        while position < (len(lst)):
-            new_df = df[[lst[position -1], lst[position]]]
-            new_df.columns = ["src", "targ"]
-            original_df = pd.concat([original_df, new_df], axis = 0)
-            position += 1
-
-    return original_df
+    pairs = list(zip(lst[:-1], lst[1:]))
+
+    if not val_col:
+        return pd.concat([df[[src, targ]].set_axis(["src", "targ"], axis=1) for src, targ in pairs], axis=0)
+
+    # factorize each column once; sorted codes keep the sorted order of groupby
+    codes = {}
+    uniques = {}
+    for col in lst:
+        col_codes, col_uniques = pd.factorize(df[col], sort=True)
+        codes[col] = col_codes.astype(np.int64)
+        uniques[col] = np.asarray(col_uniques, dtype=object)
+    values, distinct = pd.factorize(df[val_col])
+    num_values = max(len(distinct), 1)
+
+    stacked = []
+    for src, targ in pairs:
+        # groupby drops the rows that miss a label, nunique leaves out the missing values
+        keep = (codes[src] >= 0) & (codes[targ] >= 0)
+        width = max(len(uniques[targ]), 1)
+        group_codes, groups = _group_codes(codes[src][keep] * width + codes[targ][keep], len(uniques[src]) * width)
+        pair_values = values[keep]
+        counted = pair_values >= 0
+        seen = pd.unique(group_codes[counted] * num_values + pair_values[counted])
+        stacked.append(pd.DataFrame({"src": uniques[src][groups // width], "targ": uniques[targ][groups % width],
+                                     "val": np.bincount(seen // num_values, minlength=len(groups))}))
+
+    return pd.concat(stacked, axis=0)
+
+def _group_codes(keys, size):
+    '''
+    Numbers the distinct integer keys, all between 0 and size, in sorted order.
+    Returns the number of every key and the sorted distinct keys.
+    '''
+    if size > 4 * len(keys):
+        group_codes, groups = pd.factorize(keys, sort=True)
+        return group_codes.astype(np.int64), groups
+    present = np.bincount(keys, minlength=size) > 0
+    return np.cumsum(present)[keys] - 1, np.flatnonzero(present)
 
 def group_function(df, group_names, counts_name):
     '''
     Groups dataframes together and gives the count of each unique element in the counts_name column, used for
     multi-level sankey diagrams when dataframes have to be stacked
     '''
-    new_group = df.groupby(group_names, as_index = False)[counts_name].nunique()
+    new_group = df.groupby(group_names, as_index = False, observed = True)[counts_name].nunique()
 
     return new_group
 
@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import ArtistsData
+from ArtistsData import clean_bio
+from ArtistsData import _clean_bio_loop
+from ArtistsData import iter_records
+from ArtistsData import load_artists
+from ArtistsData import load_cached_artists
+
+
+@pytest.fixture
+def bios():
+    return pd.DataFrame({"ArtistBio": ["American, 1930–1992", "Spanish, born 1936", "Untitled", "born 19th c.",
+                                       "French, born Germany (Alsace). 1886–1966", "est. 12345", "c. 1000"]})
+
+
+def test_clean_bio(bios):
+    decades = clean_bio(bios.copy(), "ArtistBio", 4, "Decade")["Decade"].tolist()
+    assert decades == ["1930", "1930", 0, 0, "1880", "1230", "1000"], "Does not extract the decade"
+
+
+def test_clean_bio_matches_loop(bios):
+    expected = _clean_bio_loop(bios.copy(), "ArtistBio", 4, "Decade")["Decade"]
+    assert clean_bio(bios.copy(), "ArtistBio", 4, "Decade")["Decade"].equals(expected), \
+        "Does not match the original clean_bio"
+
+    data = pd.read_json("artists.json")
+    data = data[data["ArtistBio"].notna()]
+    expected = _clean_bio_loop(data.copy(), "ArtistBio", 4, "Decade")["Decade"]
+    assert clean_bio(data.copy(), "ArtistBio", 4, "Decade")["Decade"].equals(expected), \
+        "Does not match the original clean_bio on the museum collection"
+
+
+def test_iter_records(tmp_path):
+    records = json.load(open("artists.json"))[:200]
+    assert list(iter_records("artists.json", block_size = 100))[:200] == records, "Does not stream a JSON array"
+
+    lines = tmp_path / "artists.jsonl"
+    lines.write_text("\n".join(json.dumps(record) for record in records) + "\n")
+    assert list(iter_records(lines, block_size = 100)) == records, "Does not stream JSON lines"
+
+    empty = tmp_path / "empty.json"
+    empty.write_text(" [ ] ")
+    assert list(iter_records(empty)) == [], "Does not read an empty array"
+
+
+def test_load_artists():
+    data = pd.read_json("artists.json")
+    data = data[data["ArtistBio"].notna() & data["Nationality"].notna() & data["Gender"].notna()]
+    data = clean_bio(data, "ArtistBio", 4, "Decade")
+    expected = data[data["Decade"] != 0][["Nationality", "Gender", "DisplayName", "Decade"]].reset_index(drop = True)
+
+    loaded = load_artists("artists.json", chunk_size = 1000)
+    assert (loaded.dtypes == "category").all(), "Does not use categorical columns"
+    assert loaded[expected.columns].astype(object).equals(expected.astype(object)), \
+        "Does not keep the same artists as loading the whole file"
+
+
+def test_load_artists_empty_chunks(tmp_path):
+    records = json.load(open("artists.json"))
+    valid = [record for record in records if record.get("ArtistBio") and record.get("Nationality")
+             and record.get("Gender")][:3]
+    # a chunk where every row is dropped, then one whose names are all missing, then a complete one
+    chunks = [[dict(record, ArtistBio = None) for record in valid], [dict(record, DisplayName = None) for record in valid],
+              valid]
+    source = tmp_path / "artists.json"
+    source.write_text(json.dumps([record for chunk in chunks for record in chunk]))
+
+    loaded = load_artists(str(source), chunk_size = 3)
+    assert len(loaded) == 6, "Does not keep the rows of the other chunks"
+    assert loaded["DisplayName"].isna().sum() == 3, "Does not keep the rows without a name"
+    assert list(loaded["Gender"].astype(object)) == 2 * [record["Gender"] for record in valid], \
+        "Does not merge the chunks in order"
+
+
+def test_load_cached_artists(tmp_path, monkeypatch):
+    source = tmp_path / "artists.json"
+    shutil.copy("artists.json", source)
+    built = load_cached_artists(str(source))
+    assert (tmp_path / "artists.parquet").exists(), "Does not write the cache"
+
+    def fail(path):
+        raise AssertionError("Rebuilt an up to date cache")
+    monkeypatch.setattr(ArtistsData, "load_artists", fail)
+    assert load_cached_artists(str(source)).equals(built), "Does not read back the same dataframe"
+    os.utime(source, ns = (0, 0))
+    assert load_cached_artists(str(source)).equals(built), "Rebuilds when only the modification time changed"
+    monkeypatch.setattr(ArtistsData, "_sha256", lambda path: pytest.fail("Hashes the source again"))
+    assert load_cached_artists(str(source)).equals(built), "Does not record the new modification time"
+
+    monkeypatch.undo()
+    records = json.load(open(source))[:100]
+    source.write_text(json.dumps(records))
+    rebuilt = load_cached_artists(str(source))
+    assert rebuilt.equals(load_artists(str(source))) and len(rebuilt) < len(built), \
+        "Does not rebuild when the source changes"
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sankey import _code_mapping
+from sankey import _stack
+from sankey import group_function
+
+
+def stack_by_pairs(df, lst, val_col):
+    """ The original _stack: group_function on every adjacent pair of columns, one at a time """
+    stacked = []
+    for src, targ in zip(lst[:-1], lst[1:]):
+        pair = group_function(df, [src, targ], counts_name=val_col)
+        pair.columns = ["src", "targ", "val"]
+        stacked.append(pair)
+    return pd.concat(stacked, axis=0, ignore_index=True)
+
+
+@pytest.fixture
+def levels():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({level: rng.choice([f"{level} {i}" for i in range(5)] + [None], 500)
+                       for level in ["a", "b", "c", "d", "e"]})
+    df["name"] = rng.choice([f"name {i}" for i in range(40)] + [None], 500)
+    return df
+
+
+def test_stack_with_values(levels):
+    lst = ["a", "b", "c", "d", "e"]
+    expected = stack_by_pairs(levels, lst, "name")
+    stacked = _stack(levels, lst, "name").reset_index(drop=True)
+    assert stacked[["src", "targ"]].astype(object).equals(expected[["src", "targ"]].astype(object)), \
+        "Does not group the same pairs in the same order"
+    assert (stacked["val"].to_numpy() == expected["val"].to_numpy()).all(), "Does not count the same values"
+
+    categories = levels.astype("category")
+    expected = stack_by_pairs(categories, lst[:3], "name")
+    stacked = _stack(categories, lst[:3], "name").reset_index(drop=True)
+    assert stacked[["src", "targ"]].astype(object).equals(expected[["src", "targ"]].astype(object)), \
+        "Does not group categorical columns like groupby"
+
+
+def test_stack_without_values(levels):
+    stacked = _stack(levels, ["a", "b", "c"])
+    assert len(stacked) == 2 * len(levels) and list(stacked.columns) == ["src", "targ"], "Does not stack the pairs"
+    assert stacked["targ"].iloc[len(levels):].equals(levels["c"].rename("targ")), "Does not stack the second pair"
+
+
+def test_code_mapping(levels):
+    df = levels[["a", "b"]].dropna().assign(val=1)
+    labels = sorted(set(df["a"]) | set(df["b"]))
+    expected = {label: code for code, label in enumerate(labels)}
+
+    coded, coded_labels = _code_mapping(df, "a", "b")
+    assert coded_labels == labels, "Does not return the sorted labels"
+    assert coded["a"].tolist() == df["a"].map(expected).tolist(), "Does not code the source column"
+    assert coded["b"].tolist() == df["b"].map(expected).tolist(), "Does not code the target column"
+    assert coded["a"].dtype == np.int32 and coded["val"].equals(df["val"]), "Does not return compact codes only"
+
+    coded, coded_labels = _code_mapping(df.astype({"a": "category", "b": "category"}), "a", "b")
+    assert coded_labels == labels and coded["b"].tolist() == df["b"].map(expected).tolist(), \
+        "Does not code categorical columns"
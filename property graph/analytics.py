@@ -0,0 +1,124 @@
+"""
+File: analytics.py
+Description: Graph-wide statistics for a PropertyGraph: degree histograms
+per relationship category, weakly connected components and (personalized)
+PageRank.  All of them run on the CSR arrays of the graph (see csrgraph.py),
+built on the fly when the graph is not frozen.
+
+"""
+
+import numpy as np
+
+from csrgraph import CSRGraph
+
+
+def compact_form(graph):
+    """ Return the CSRGraph of a graph, building it if the graph is not frozen """
+    if graph.frozen:
+        return graph.propertyGraph
+    return CSRGraph.from_adjacency(graph.propertyGraph)
+
+
+def _edge_mask(compact, rel_categories):
+    """ Boolean mask of the relationships whose category is in rel_categories (all if None) """
+    if rel_categories is None:
+        return np.ones(compact.num_edges(), dtype=bool)
+    if isinstance(rel_categories, str):
+        rel_categories = [rel_categories]
+    codes = [compact.rel_categories[category] for category in rel_categories if category in compact.rel_categories]
+    return np.isin(compact.rel_codes[compact.rel_ids], codes)
+
+
+def _sources(compact):
+    """ Source node id of every outgoing relationship """
+    return np.repeat(np.arange(len(compact)), np.diff(compact.offsets))
+
+
+def degree_histogram(graph, direction="out", node_category=None):
+    """ Return {rel_category: {degree: number of nodes}} counting, for every
+    relationship category, how many nodes have each degree (including 0).
+    direction is "out", "in" or "both"; node_category limits the nodes counted """
+    if direction not in ("in", "out", "both"):
+        raise ValueError(f'direction must be "in", "out" or "both", not {direction!r}')
+    compact = compact_form(graph)
+    n = len(compact)
+    sources = _sources(compact)
+    counted = np.ones(n, dtype=bool)
+    if node_category is not None:
+        counted = compact.node_codes == compact.node_categories.get(node_category, -1)
+
+    histograms = {}
+    for category in compact.rel_categories:
+        mask = _edge_mask(compact, category)
+        degrees = np.zeros(n, dtype=np.int64)
+        if direction in ("out", "both"):
+            degrees += np.bincount(sources[mask], minlength=n)
+        if direction in ("in", "both"):
+            degrees += np.bincount(compact.targets[mask], minlength=n)
+        counts = np.bincount(degrees[counted])
+        histograms[category] = {degree: int(count) for degree, count in enumerate(counts) if count}
+    return histograms
+
+
+def connected_components(graph, rel_categories=None):
+    """ Return the weakly connected components of the graph as a list of
+    sets of nodes, largest first, using union-find over the relationships """
+    compact = compact_form(graph)
+    mask = _edge_mask(compact, rel_categories)
+    parent = list(range(len(compact)))
+
+    def find(i):
+        while parent[i] != i:
+            # path halving
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for src, targ in zip(_sources(compact)[mask].tolist(), compact.targets[mask].tolist()):
+        root_src, root_targ = find(src), find(targ)
+        if root_src != root_targ:
+            parent[max(root_src, root_targ)] = min(root_src, root_targ)
+
+    components = {}
+    for i, node in enumerate(compact.nodes):
+        components.setdefault(find(i), set()).add(node)
+    return sorted(components.values(), key=len, reverse=True)
+
+
+def pagerank(graph, damping=0.85, personalization=None, rel_categories=None, tol=1e-10, max_iter=100):
+    """ Return {node: score} with the PageRank of every node, following the
+    outgoing relationships of rel_categories (all if None).
+    personalization is an optional node, or dictionary of node -> weight, that
+    random jumps (and walks stuck at nodes without relationships) return to;
+    with it the result is the personalized PageRank of those nodes """
+    compact = compact_form(graph)
+    n = len(compact)
+    if n == 0:
+        return {}
+    mask = _edge_mask(compact, rel_categories)
+    sources = _sources(compact)[mask]
+    targets = compact.targets[mask]
+    out_degree = np.bincount(sources, minlength=n).astype(np.float64)
+    dangling = out_degree == 0
+
+    if personalization is None:
+        jump = np.full(n, 1.0 / n)
+    else:
+        if not isinstance(personalization, dict):
+            personalization = {personalization: 1.0}
+        jump = np.zeros(n)
+        for node, weight in personalization.items():
+            jump[compact.ids[node]] += weight
+        jump /= jump.sum()
+
+    scores = jump.copy()
+    share = np.zeros(n)
+    for _ in range(max_iter):
+        np.divide(scores, out_degree, out=share, where=~dangling)
+        spread = np.bincount(targets, weights=share[sources], minlength=n)
+        new_scores = damping * spread + (damping * scores[dangling].sum() + 1 - damping) * jump
+        converged = np.abs(new_scores - scores).sum() < tol
+        scores = new_scores
+        if converged:
+            break
+    return dict(zip(compact.nodes, scores.tolist()))
@@ -0,0 +1,107 @@
+"""
+File: bench_memory.py
+Description: Measures how much memory a PropertyGraph holds per node and per
+relationship: the nodes, their properties and the graph's indexes and
+adjacency, for graphs built with add_node/add_relationship and bulk_load,
+with one Relationship object per edge or shared relationships, and frozen.
+Run it on older commits to compare layouts.
+Run with: python bench_memory.py [num_nodes] [num_edges]
+
+"""
+
+import gc
+import random
+import sys
+import tracemalloc
+
+from propertygraph import Node
+from propertygraph import PropertyGraph
+from propertygraph import Relationship
+
+
+def measure(build):
+    """ Return the bytes still allocated after build() and the object it returned """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def make_nodes(num_nodes):
+    """ Persons without properties and Books with a Price, like recommend.py """
+    nodes = []
+    for i in range(num_nodes):
+        if i % 4 == 0:
+            nodes.append(Node(f"book {i}", "Book", ("Price", float(i % 200))))
+        else:
+            nodes.append(Node(f"person {i}", "Person"))
+    return nodes
+
+
+def make_edges(make_rel, nodes, num_edges):
+    """ (src, targ, rel) tuples: people buy books and know people """
+    rng = random.Random(0)
+    books = nodes[::4]
+    people = [node for i, node in enumerate(nodes) if i % 4]
+    for i in range(num_edges):
+        if i % 3:
+            yield rng.choice(people), rng.choice(books), make_rel("bought")
+        else:
+            yield rng.choice(people), rng.choice(people), make_rel("known")
+
+
+def graph_of_nodes(num_nodes):
+    graph = PropertyGraph()
+    for node in make_nodes(num_nodes):
+        graph.add_node(node)
+    return graph
+
+
+def add_relationships(make_rel, num_nodes, num_edges):
+    graph = PropertyGraph()
+    nodes = make_nodes(num_nodes)
+    for node in nodes:
+        graph.add_node(node)
+    for src, targ, rel in make_edges(make_rel, nodes, num_edges):
+        graph.add_relationship(src, targ, rel)
+    return graph
+
+
+def bulk_load(make_rel, num_nodes, num_edges, freeze=False):
+    graph = PropertyGraph()
+    nodes = make_nodes(num_nodes)
+    graph.bulk_load(nodes, make_edges(make_rel, nodes, num_edges))
+    if freeze:
+        graph.freeze()
+    return graph
+
+
+def main():
+    num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_edges = int(sys.argv[2]) if len(sys.argv) > 2 else 500000
+    # older layouts have no shared relationships, bulk_load or freeze
+    shared = getattr(Relationship, "shared", Relationship)
+
+    node_bytes, _ = measure(lambda: graph_of_nodes(num_nodes))
+    print(f"{num_nodes} nodes, {num_edges} relationships")
+    print(f"{'':46}{'bytes':>8}")
+    print(f"{'node in a graph, per node':46}{node_bytes / num_nodes:8.1f}")
+
+    graphs = [("add_relationship, one rel per edge", lambda: add_relationships(Relationship, num_nodes, num_edges)),
+              ("add_relationship, shared rels", lambda: add_relationships(shared, num_nodes, num_edges))]
+    if hasattr(PropertyGraph, "bulk_load"):
+        graphs.append(("bulk_load, shared rels", lambda: bulk_load(shared, num_nodes, num_edges)))
+    if hasattr(PropertyGraph, "bulk_load") and hasattr(PropertyGraph, "freeze"):
+        graphs.append(("bulk_load then freeze, shared rels", lambda: bulk_load(shared, num_nodes, num_edges, True)))
+    for name, build in graphs:
+        graph_bytes, _ = measure(build)
+        print(f"{name + ', per edge':46}{graph_bytes / num_edges:8.1f}"
+              f"   ({(graph_bytes - node_bytes) / num_edges:.1f} after taking off the node row)")
+
+
+if __name__ == "__main__":
+    main()
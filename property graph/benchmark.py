@@ -0,0 +1,232 @@
+"""
+File: benchmark.py
+Description: Benchmarks PropertyGraph and the recommenders on synthetic
+Person/Book graphs.  Sources and targets of the relationships are drawn
+from power-law (Zipf) distributions, so a few people know and buy a lot
+and a few books are bought by many, as in real purchase graphs.
+
+For every graph size it reports ingest throughput, query latency
+percentiles and peak memory, and saves the results as JSON so that runs on
+different commits can be compared.  Every size runs in its own process, so
+that its peak memory is not the peak of a larger size run before it:
+
+    python benchmark.py --edges 1000 100000 1000000 --output after.json
+    python benchmark.py --edges 1000 100000 --output after.json --compare before.json
+
+"""
+
+import argparse
+import bisect
+import gc
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from itertools import accumulate
+
+from propertygraph import Node
+from propertygraph import PropertyGraph
+from propertygraph import Relationship
+from recommend import recommend
+from recommend import recommend_top_k
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def zipf_sampler(n, exponent, rng):
+    """ Return a function drawing indexes 0..n-1 with probability ~ 1 / (i + 1) ** exponent """
+    cum_weights = list(accumulate(1.0 / (i + 1) ** exponent for i in range(n)))
+    total = cum_weights[-1]
+    return lambda: bisect.bisect_left(cum_weights, rng.random() * total)
+
+
+def synthetic_graph(num_edges, exponent=1.1, known_share=0.3, seed=0):
+    """ Return (people, books, edges): the nodes and a generator of num_edges
+    (src, targ, rel) tuples, known_share of them known relationships and the
+    rest bought relationships, with power-law distributed endpoints """
+    rng = random.Random(seed)
+    people = [Node(f"person {i}", "Person") for i in range(max(num_edges // 10, 2))]
+    books = [Node(f"book {i}", "Book", ("Price", round(rng.uniform(5, 200), 2)))
+             for i in range(max(num_edges // 20, 2))]
+    # shuffle the ranks so that popular people are not also the most active ones
+    person_rank = zipf_sampler(len(people), exponent, rng)
+    friend_rank = zipf_sampler(len(people), exponent, rng)
+    book_rank = zipf_sampler(len(books), exponent, rng)
+    order = list(range(len(people)))
+    rng.shuffle(order)
+    known = Relationship.shared("known")
+    bought = Relationship.shared("bought")
+
+    def edges():
+        for _ in range(num_edges):
+            src = people[person_rank()]
+            if rng.random() < known_share:
+                yield src, people[order[friend_rank()]], known
+            else:
+                yield src, books[book_rank()], bought
+
+    return people, books, edges()
+
+
+def percentiles(samples):
+    """ p50, p90, p99 and max of a list of latencies in seconds, in microseconds """
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6
+    return {"p50_us": pick(0.5), "p90_us": pick(0.9), "p99_us": pick(0.99), "max_us": samples[-1] * 1e6}
+
+
+def time_queries(queries):
+    """ Run every zero-argument function in queries, return their latency percentiles """
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        query()
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def max_rss_mb():
+    """ Peak resident memory of the process in MB, None where it can not be read """
+    if resource is None:
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return kb / 1024 if platform.system() != "Darwin" else kb / 1024 / 1024
+
+
+def run_benchmark(num_edges, num_queries=200, trace_memory=False, seed=0):
+    """ Benchmark one graph size and return the results as a dictionary """
+    results = {"edges": num_edges}
+    people, books, edges = synthetic_graph(num_edges, seed=seed)
+    # generate up front so that only the graph is timed
+    edges = list(edges)
+    results["nodes"] = len(people) + len(books)
+
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    graph = PropertyGraph(indexed_keys=["Price"])
+    graph.bulk_load(people + books, edges)
+    elapsed = time.perf_counter() - start
+    results["bulk_load_edges_per_s"] = num_edges / elapsed
+    if trace_memory:
+        results["ingest_peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    # add_relationship one edge at a time, on a sample to keep large runs short
+    sample = min(num_edges, 100000)
+    edges = edges[:sample]
+    single = PropertyGraph(indexed_keys=["Price"])
+    start = time.perf_counter()
+    for src, targ, rel in edges:
+        single.add_relationship(src, targ, rel)
+    results["add_relationship_edges_per_s"] = sample / (time.perf_counter() - start)
+    del single, edges
+
+    rng = random.Random(seed + 1)
+    some_people = [rng.choice(people) for _ in range(num_queries)]
+    some_books = [rng.choice(books) for _ in range(num_queries)]
+    prices = [book["Price"] for book in some_books]
+    recommendation = Relationship("Recommendation")
+
+    def query_suite(prefix):
+        results[prefix + "get_nodes_name"] = time_queries(
+            [lambda p=p: graph.get_nodes(name=p.name) for p in some_people])
+        results[prefix + "get_nodes_price"] = time_queries(
+            [lambda price=price: graph.get_nodes(key="Price", value=price) for price in prices])
+        results[prefix + "adjacent_known"] = time_queries(
+            [lambda p=p: graph.adjacent(p, rel_category="known") for p in some_people])
+        results[prefix + "adjacent_bought_in"] = time_queries(
+            [lambda b=b: graph.adjacent(b, rel_category="bought", direction="in") for b in some_books])
+        results[prefix + "recommend"] = time_queries(
+            [lambda p=p: recommend(p, graph, recommendation) for p in some_people])
+        results[prefix + "recommend_top_k"] = time_queries(
+            [lambda p=p: recommend_top_k(p, graph, k=10) for p in some_people])
+
+    query_suite("")
+    start = time.perf_counter()
+    graph.freeze()
+    results["freeze_s"] = time.perf_counter() - start
+    query_suite("frozen_")
+
+    results["max_rss_mb"] = max_rss_mb()
+    return results
+
+
+def run_isolated(num_edges, num_queries=200, trace_memory=False, seed=0):
+    """ run_benchmark in a fresh Python process, so that max_rss_mb is the
+    peak of this graph size alone """
+    command = [sys.executable, __file__, "--single", str(num_edges), "--queries", str(num_queries),
+               "--seed", str(seed)]
+    if trace_memory:
+        command.append("--trace-memory")
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def git_revision():
+    """ The current commit, or None outside a git checkout """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """ Print the ratio new / old of every number both runs measured """
+    old_runs = {run["edges"]: run for run in baseline["runs"]}
+    for run in results["runs"]:
+        old = old_runs.get(run["edges"])
+        if old is None:
+            continue
+        print(f"\n{run['edges']} edges, {baseline.get('commit')} -> {results.get('commit')}")
+        for name, value in run.items():
+            old_value = old.get(name)
+            if isinstance(value, dict) and isinstance(old_value, dict):
+                print(f"  {name:32} p50 x{value['p50_us'] / old_value['p50_us']:.2f}  "
+                      f"p99 x{value['p99_us'] / old_value['p99_us']:.2f}")
+            elif isinstance(value, (int, float)) and isinstance(old_value, (int, float)) and old_value:
+                print(f"  {name:32} x{value / old_value:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--edges", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="graph sizes to benchmark, in relationships")
+    parser.add_argument("--queries", type=int, default=200, help="queries timed per query type")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also measure the traced peak memory of ingest (slows ingest down)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file to save the results to")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    # benchmark one size in this process and print its results, see run_isolated
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(run_benchmark(args.single, args.queries, args.trace_memory, args.seed)))
+        return
+
+    results = {"commit": git_revision(), "python": platform.python_version(), "runs": []}
+    for num_edges in args.edges:
+        run = run_isolated(num_edges, args.queries, args.trace_memory, args.seed)
+        results["runs"].append(run)
+        print(json.dumps(run, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+File: csrgraph.py
+Description: A compact, read-only store for the relationships of a PropertyGraph.
+Nodes are interned to integer ids and relationships are kept in
+compressed sparse row (CSR) NumPy arrays: the outgoing relationships of
+node i are targets[offsets[i]:offsets[i + 1]], with the matching
+Relationship objects in rel_ids.  Incoming relationships are stored the same way.
+
+A CSRGraph is a read-only mapping of node -> [(targ, rel), ...] so it can
+stand in for the propertyGraph dictionary of a frozen PropertyGraph.
+
+"""
+
+from collections.abc import Mapping
+
+import numpy as np
+
+
+def _index_dtype(size):
+    """ Smallest integer type able to hold the ids 0..size """
+    return np.int32 if size < 2 ** 31 else np.int64
+
+
+class CSRGraph(Mapping):
+
+    def __init__(self, nodes, offsets, targets, rel_ids, rels, incoming=None):
+        """ Class constructor.
+        nodes - list of Node objects, the position of a node is its id
+        offsets, targets, rel_ids - CSR arrays of the outgoing relationships
+        rels - list of the distinct Relationship objects indexed by rel_ids
+        incoming - optional (in_offsets, in_sources, in_rel_ids) arrays,
+        computed from the outgoing arrays when not given """
+        self.nodes = nodes
+        self.ids = {node: i for i, node in enumerate(nodes)}
+        self.rels = rels
+        self.offsets = offsets
+        self.targets = targets
+        self.rel_ids = rel_ids
+
+        # category codes of every node and of every distinct relationship
+        self.node_categories, self.node_codes = self._encode(node.category for node in nodes)
+        self.rel_categories, self.rel_codes = self._encode(rel.category for rel in rels)
+
+        if incoming is not None:
+            self.in_offsets, self.in_sources, self.in_rel_ids = incoming
+            return
+
+        # incoming relationships: the outgoing arrays sorted by target
+        n = len(nodes)
+        sources = np.repeat(np.arange(n, dtype=targets.dtype), np.diff(offsets))
+        order = np.argsort(targets, kind="stable")
+        self.in_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(targets, minlength=n), out=self.in_offsets[1:])
+        self.in_sources = sources[order]
+        self.in_rel_ids = rel_ids[order]
+
+    @staticmethod
+    def _encode(categories):
+        """ Return ({category: code}, array of codes) for a sequence of categories """
+        table = {}
+        codes = [table.setdefault(category, len(table)) for category in categories]
+        return table, np.array(codes, dtype=np.int32)
+
+    @classmethod
+    def from_adjacency(cls, adjacency):
+        """ Build a CSRGraph from a dictionary of node -> [(targ, rel), ...] """
+        nodes = list(adjacency.keys())
+        ids = {node: i for i, node in enumerate(nodes)}
+        dtype = _index_dtype(len(nodes))
+
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, adjacency.values()), dtype=np.int64, count=len(nodes)),
+                  out=offsets[1:])
+        n_edges = int(offsets[-1])
+
+        # Relationship objects are shared between edges, so store each one once
+        rels = []
+        rel_table = {}
+
+        def rel_id(rel):
+            key = id(rel)
+            if key not in rel_table:
+                rel_table[key] = len(rels)
+                rels.append(rel)
+            return rel_table[key]
+
+        targets = np.fromiter((ids[targ] for edges in adjacency.values() for targ, rel in edges),
+                              dtype=dtype, count=n_edges)
+        rel_ids = np.fromiter((rel_id(rel) for edges in adjacency.values() for targ, rel in edges),
+                              dtype=np.int32, count=n_edges)
+        return cls(nodes, offsets, targets, rel_ids, rels)
+
+    def num_edges(self):
+        """ Return the number of relationships """
+        return len(self.targets)
+
+    def __getitem__(self, node):
+        """ Return the outgoing relationships of node as a list of (targ, rel) """
+        i = self.ids[node]
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return [(self.nodes[t], self.rels[r])
+                for t, r in zip(self.targets[lo:hi].tolist(), self.rel_ids[lo:hi].tolist())]
+
+    def __contains__(self, node):
+        return node in self.ids
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def neighbours(self, i, node_category=None, rel_category=None, direction="out"):
+        """ Return (node ids, rel ids) arrays of the relationships of node id i
+        that match the node and relationship categories """
+        if direction == "out":
+            sides = [(self.offsets, self.targets, self.rel_ids)]
+        elif direction == "in":
+            sides = [(self.in_offsets, self.in_sources, self.in_rel_ids)]
+        elif direction == "both":
+            sides = [(self.offsets, self.targets, self.rel_ids),
+                     (self.in_offsets, self.in_sources, self.in_rel_ids)]
+        else:
+            raise ValueError(f'direction must be "in", "out" or "both", not {direction!r}')
+
+        found_nodes = []
+        found_rels = []
+        for offsets, others, rel_ids in sides:
+            lo, hi = offsets[i], offsets[i + 1]
+            others = others[lo:hi]
+            rel_ids = rel_ids[lo:hi]
+            mask = np.ones(len(others), dtype=bool)
+            if rel_category:
+                if rel_category not in self.rel_categories:
+                    continue
+                mask &= self.rel_codes[rel_ids] == self.rel_categories[rel_category]
+            if node_category:
+                if node_category not in self.node_categories:
+                    continue
+                mask &= self.node_codes[others] == self.node_categories[node_category]
+            found_nodes.append(others[mask])
+            found_rels.append(rel_ids[mask])
+
+        if not found_nodes:
+            return np.empty(0, dtype=self.targets.dtype), np.empty(0, dtype=np.int32)
+        return np.concatenate(found_nodes), np.concatenate(found_rels)
+
+    def adjacent(self, node, node_category=None, rel_category=None, direction="out"):
+        """ Same as PropertyGraph.adjacent, return a set of (node, rel) tuples """
+        node_ids, rel_ids = self.neighbours(self.ids[node], node_category, rel_category, direction)
+        return {(self.nodes[n], self.rels[r]) for n, r in zip(node_ids.tolist(), rel_ids.tolist())}
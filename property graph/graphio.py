@@ -0,0 +1,258 @@
+"""
+File: graphio.py
+Description: Streaming loaders that build a PropertyGraph from CSV and
+JSON-lines files through PropertyGraph.bulk_load.  Input is read one
+batch at a time, so files larger than memory can be loaded.
+
+CSV node files have the columns name, category and one column per property.
+CSV edge files have the columns src, src_category, rel, targ, targ_category
+and one column per relationship property.  Empty property cells are skipped
+and property values are parsed as JSON where possible ("17.0" -> 17.0).
+
+JSON-lines files hold one record per line:
+    {"type": "node", "name": ..., "category": ..., "props": {...}}
+    {"type": "edge", "src": [name, category], "rel": ..., "targ": [name, category], "props": {...}}
+
+The same module streams a graph back out as text, JSON lines or GraphML
+without building the whole output in memory.
+
+"""
+
+import csv
+import json
+import os
+from contextlib import nullcontext
+from itertools import islice
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+
+from propertygraph import Node
+from propertygraph import Relationship
+
+
+class NodeTable:
+    """ Resolves (name, category) pairs to a single Node object per node,
+    reusing the nodes already in the graph """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.nodes = {}
+
+    def node(self, name, category, props=None):
+        """ Return the Node for (name, category), creating it if needed.
+        props, if given, are set on the node """
+        key = (name, category)
+        node = self.nodes.get(key)
+        if node is None:
+            found = self.graph.get_nodes(name=name, category=category) if name and category else ()
+            node = next(iter(found)) if found else Node(name, category)
+            self.nodes[key] = node
+        for prop, value in (props or {}).items():
+            node[prop] = value
+        return node
+
+
+def relationship(category, props=None):
+    """ Return a Relationship, shared between edges when it has no properties """
+    if not props:
+        return Relationship.shared(category)
+    rel = Relationship(category)
+    for key, value in props.items():
+        rel[key] = value
+    return rel
+
+
+def node_record(node):
+    """ The JSON-lines record of a node """
+    record = {"type": "node", "name": node.name, "category": node.category}
+    if node._props:
+        record["props"] = node._props
+    return record
+
+
+def edge_record(src, targ, rel):
+    """ The JSON-lines record of a relationship """
+    record = {"type": "edge", "src": [src.name, src.category], "rel": rel.category,
+              "targ": [targ.name, targ.category]}
+    if rel._props:
+        record["props"] = rel._props
+    return record
+
+
+def _parse_value(text):
+    """ Parse a CSV property value as JSON, keeping it as a string otherwise """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _csv_props(row, columns):
+    """ The non-empty property columns of a CSV row """
+    return {column: _parse_value(row[column]) for column in columns if row[column] not in (None, "")}
+
+
+def _open(file, mode="r"):
+    """ Accept either a path or an open file object. Use in a with statement:
+    a file opened from a path is closed at the end, an open file object is left open """
+    if isinstance(file, (str, os.PathLike)):
+        return open(file, mode, newline="", encoding="utf-8")
+    return nullcontext(file)
+
+
+def read_csv_nodes(file, table):
+    """ Yield the nodes of a CSV node file """
+    with _open(file) as f:
+        reader = csv.DictReader(f)
+        columns = [column for column in reader.fieldnames if column not in ("name", "category")]
+        for row in reader:
+            yield table.node(row["name"], row["category"], _csv_props(row, columns))
+
+
+def read_csv_edges(file, table):
+    """ Yield (src, targ, rel) tuples from a CSV edge file """
+    fixed = ("src", "src_category", "rel", "targ", "targ_category")
+    with _open(file) as f:
+        reader = csv.DictReader(f)
+        columns = [column for column in reader.fieldnames if column not in fixed]
+        for row in reader:
+            src = table.node(row["src"], row["src_category"])
+            targ = table.node(row["targ"], row["targ_category"])
+            yield src, targ, relationship(row["rel"], _csv_props(row, columns))
+
+
+def load_csv(graph, edges_file=None, nodes_file=None, batch_size=10000):
+    """ Load a CSV node file and/or a CSV edge file into graph """
+    table = NodeTable(graph)
+    nodes = read_csv_nodes(nodes_file, table) if nodes_file else ()
+    edges = read_csv_edges(edges_file, table) if edges_file else ()
+    graph.bulk_load(nodes, edges, batch_size)
+    return graph
+
+
+def read_jsonl(file, table):
+    """ Yield ("node", node) and ("edge", (src, targ, rel)) items from a JSON-lines file """
+    with _open(file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["type"] == "node":
+                yield "node", table.node(record["name"], record["category"], record.get("props"))
+            elif record["type"] == "edge":
+                src = table.node(*record["src"])
+                targ = table.node(*record["targ"])
+                yield "edge", (src, targ, relationship(record["rel"], record.get("props")))
+            else:
+                raise ValueError(f"unknown record type {record['type']!r}")
+
+
+def load_jsonl(graph, file, batch_size=10000):
+    """ Load a JSON-lines file of node and edge records into graph """
+    graph._check_mutable()
+    items = read_jsonl(file, NodeTable(graph))
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            break
+        nodes = [item for kind, item in batch if kind == "node"]
+        edges = [item for kind, item in batch if kind == "edge"]
+        graph._load_batch(nodes, edges)
+    return graph
+
+
+def iter_jsonl(graph):
+    """ Yield the JSON-lines records of graph: every node, then every relationship """
+    for node in graph.propertyGraph:
+        yield json.dumps(node_record(node))
+    for src in graph.propertyGraph:
+        for targ, rel in graph.propertyGraph[src]:
+            yield json.dumps(edge_record(src, targ, rel))
+
+
+def _graphml_type(value):
+    """ The GraphML attribute type of one property value """
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "long"
+    if isinstance(value, float):
+        return "double"
+    return "string"
+
+
+def _widen(type_a, type_b):
+    """ The narrowest GraphML attribute type able to hold values of both types """
+    if type_a == type_b:
+        return type_a
+    if {type_a, type_b} == {"long", "double"}:
+        return "double"
+    return "string"
+
+
+def _graphml_keys(items, domain, prefix):
+    """ Return ({property: key id}, <key> lines) for the properties of items """
+    # the narrowest type so far of every key, instead of all of its values
+    types = {}
+    for item in items:
+        for key, value in item._props.items():
+            value_type = _graphml_type(value)
+            key_type = types.get(key, value_type)
+            types[key] = key_type if key_type == value_type else _widen(key_type, value_type)
+    ids = {}
+    lines = [f'  <key id="{prefix}category" for="{domain}" attr.name="category" attr.type="string"/>']
+    for i, (key, key_type) in enumerate(types.items()):
+        ids[key] = f"{prefix}{i}"
+        lines.append(f'  <key id="{prefix}{i}" for="{domain}" attr.name={quoteattr(str(key))} '
+                     f'attr.type="{key_type}"/>')
+    return ids, lines
+
+
+def _graphml_data(item, ids, prefix):
+    data = [f'<data key="{prefix}category">{escape(str(item.category))}</data>']
+    for key, value in item._props.items():
+        data.append(f'<data key="{ids[key]}">{escape(str(value).lower() if isinstance(value, bool) else str(value))}</data>')
+    return "".join(data)
+
+
+def iter_graphml(graph):
+    """ Yield graph as GraphML lines; node names become node ids """
+    nodes = graph.propertyGraph
+    node_keys, lines = _graphml_keys(nodes, "node", "node_")
+    rels = (rel for src in nodes for _, rel in nodes[src])
+    rel_keys, rel_lines = _graphml_keys(rels, "edge", "edge_")
+
+    yield '<?xml version="1.0" encoding="UTF-8"?>'
+    yield '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">'
+    yield '  <key id="node_name" for="node" attr.name="name" attr.type="string"/>'
+    yield from lines
+    yield from rel_lines
+    yield '  <graph edgedefault="directed">'
+    ids = {}
+    for node in nodes:
+        ids[node] = f"n{len(ids)}"
+        yield (f'    <node id="{ids[node]}"><data key="node_name">{escape(str(node.name))}</data>'
+               f'{_graphml_data(node, node_keys, "node_")}</node>')
+    for src in nodes:
+        for targ, rel in nodes[src]:
+            yield (f'    <edge source="{ids[src]}" target="{ids[targ]}">'
+                   f'{_graphml_data(rel, rel_keys, "edge_")}</edge>')
+    yield '  </graph>'
+    yield '</graphml>'
+
+
+def write_graph(graph, file, fmt="text", chunk_size=1000):
+    """ Write graph to an open file object, chunk_size lines per write """
+    if fmt == "text":
+        lines = graph.iter_lines()
+    elif fmt == "jsonl":
+        lines = iter_jsonl(graph)
+    elif fmt == "graphml":
+        lines = iter_graphml(graph)
+    else:
+        raise ValueError(f'fmt must be "text", "jsonl" or "graphml", not {fmt!r}')
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            break
+        file.write("\n".join(chunk) + "\n")
@@ -6,28 +6,109 @@ properties.  Property graphs are used to represent connected knowledge.
 
 """
 
+import functools
+import sys
+import weakref
+from collections import deque
+from collections.abc import Mapping
+from contextlib import nullcontext
+from itertools import islice
+from types import MappingProxyType
+
+
+# Nodes and relationships without properties all share this empty dictionary
+# instead of allocating their own; it must never be modified
+_NO_PROPS = {}
+
+# The read-only props of shared relationships
+_SHARED_PROPS = MappingProxyType(_NO_PROPS)
+
+# The old value of a property that was not set before, see Node.__setitem__
+_UNSET = object()
+
+# The shared, property-less relationship of each category, see Relationship.shared
+_shared_relationships = {}
+
+# One (rel category, node category) tuple per pair, used as the partition key of every node
+_partition_keys = {}
+
+# Entered instead of a lock by the read_lock() and write_lock() of graphs
+# that are not thread-safe
+_NO_LOCK = nullcontext()
+
+
+def _intern(category):
+    """ Intern string categories so that equal categories share one string object """
+    return sys.intern(category) if isinstance(category, str) else category
+
+
+def _partition_key(rel_category, node_category):
+    """ Return the shared partition key for relationships of rel_category to nodes of node_category """
+    key = (rel_category, node_category)
+    return _partition_keys.setdefault(key, key)
+
+
+def _locked(method, side):
+    """ Wrap method so that it runs while holding one side of an RWLock """
+    @functools.wraps(method)
+    def locked(*args, **kwargs):
+        with side:
+            return method(*args, **kwargs)
+    return locked
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
 
 class Node:
 
+    # no per-instance __dict__: a node costs its slots and, only when it
+    # has properties, one dictionary
+    __slots__ = ("name", "category", "_props", "_graphs")
+
     def __init__(self, name, category, props=None):
         """ Class constructor """
         self.name = name
-        self.category = category
-        self.props = {}
+        self.category = _intern(category)
+        self._props = _NO_PROPS
         if props:
-            self.props[props[0]] = props[1]
+            self._props = {props[0]: props[1]}
+        # weak reference (a list of them once in several graphs) to the property
+        # graphs holding this node, told about property changes so that they can
+        # keep their property indexes up to date
+        self._graphs = None
+
+    @property
+    def props(self):
+        """ The properties of the node, allocated on first use """
+        if self._props is _NO_PROPS:
+            self._props = {}
+        return self._props
 
     def __getitem__(self, key):
         """ Fetch a property from the node using []
          return None if property doesn't exist """
-        if key in self.props.keys():
-            return self.props[key]
-        else:
-            return None
+        return self._props.get(key)
 
     def __setitem__(self, key, value):
         """ Set a node property with a specified value using [] """
-        self.props[key] = value
+        stored = False
+        if self._graphs is not None:
+            # the graphs store the value under their write locks; the old value is
+            # read once, as the first graph has already replaced it for the others
+            old = self._props.get(key, _UNSET)
+            for ref in self._graphs if type(self._graphs) is list else (self._graphs,):
+                graph = ref()
+                if graph is not None:
+                    graph._on_set_prop(self, key, old, value)
+                    stored = True
+        if not stored:
+            self.props[key] = value
 
 
     def __eq__(self, other):
@@ -44,12 +125,22 @@ class Node:
         store them as keys in a dictionary! """
         return hash((self.name, self.category))
 
+    def __getstate__(self):
+        """ Pickle the node without the graphs holding it """
+        return self.name, self.category, self._props or None
+
+    def __setstate__(self, state):
+        self.name, category, props = state
+        self.category = _intern(category)
+        self._props = props or _NO_PROPS
+        self._graphs = None
+
     def __repr__(self):
         """ Output the node as a string in the following format:
         name:category<tab>properties.
         Note: __repr__ is more versatile than __str__ """
-        if self.props:
-             return f'Node({self.name}:{self.category}     {self.props})'
+        if self._props:
+             return f'Node({self.name}:{self.category}     {self._props})'
         else:
             return f'Node({self.name}:{self.category})'
 
@@ -57,23 +148,48 @@ class Node:
 
 class Relationship:
 
+    __slots__ = ("category", "_props")
+
     def __init__(self, category, props=None):
         """ Class constructor """
-        self.category = category
-        self.props = {}
+        self.category = _intern(category)
+        self._props = _NO_PROPS
         if props:
-            self.props[props[0]] = props[1]
+            self._props = {props[0]: props[1]}
+
+    @classmethod
+    def shared(cls, category):
+        """ Return the single property-less relationship of the category.
+        Edges that carry no properties can all point at this one object;
+        setting a property on it raises TypeError """
+        rel = _shared_relationships.get(category)
+        if rel is None:
+            rel = _shared_relationships[category] = cls(category)
+        return rel
+
+    def is_shared(self):
+        """ True for the relationship returned by Relationship.shared """
+        return _shared_relationships.get(self.category) is self
+
+    @property
+    def props(self):
+        """ The properties of the relationship, allocated on first use.
+        Read-only for shared relationships """
+        if self._props is _NO_PROPS:
+            if self.is_shared():
+                return _SHARED_PROPS
+            self._props = {}
+        return self._props
 
     def __getitem__(self, key):
         """ Fetch a property from the node using []
          return None if property doesn't exist """
-        if key in self.props.keys():
-            return self.props[key]
-        else:
-            return None
+        return self._props.get(key)
 
     def __setitem__(self, key, value):
         """ Set a node property with a specified value using [] """
+        if self.is_shared():
+            raise TypeError(f"shared relationship {self!r} can not carry properties")
         self.props[key] = value
 
     def __repr__(self):
@@ -81,91 +197,603 @@ class Relationship:
         :category<space>properties.
         Note: __repr__ is more versatile than __str__ """
 
-        if self.props:
-            return f'Relationship(:{self.category} {self.props})'
+        if self._props:
+            return f'Relationship(:{self.category} {self._props})'
         else:
             return f'Relationship({self.category})'
 
 
 
+class _Adjacency(Mapping):
+    """ The propertyGraph mapping of a PropertyGraph, node -> [(targ, rel), ...],
+    assembled from the outgoing partitions so that every relationship is stored once.
+    The lists are fresh copies, grouped by partition. """
+
+    def __init__(self, outgoing):
+        self.outgoing = outgoing
+
+    def __getitem__(self, node):
+        return [relationship for relationships in self.outgoing[node].values() for relationship in relationships]
+
+    def __contains__(self, node):
+        return node in self.outgoing
+
+    def __iter__(self):
+        return iter(self.outgoing)
+
+    def __len__(self):
+        return len(self.outgoing)
+
+
+
 class PropertyGraph:
 
-    def __init__(self):
-        """ Construct an empty property graph """
-        self.propertyGraph = {}
+    # run under the read side of the lock in thread-safe mode
+    _READERS = ("get_nodes", "estimate_nodes", "adjacent", "num_relationships", "subgraph", "save", "write")
+    # run under the write side of the lock in thread-safe mode
+    _WRITERS = ("create_index", "drop_index", "subscribe", "unsubscribe", "_on_set_prop", "add_node",
+                "add_relationship", "remove_relationship", "_load_batch", "freeze", "thaw")
+
+    def __init__(self, indexed_keys=None, cache_size=None, cache_policy="lru", cache_ttl=None,
+                 thread_safe=False):
+        """ Construct an empty property graph.
+        indexed_keys is an optional list of property keys to maintain
+        (key, value) indexes for. Nodes are always indexed by name and category.
+        cache_size, if given, turns on a cache of that many adjacent() and
+        get_nodes() results (see querycache.py); cache_policy is "lru" or "fifo"
+        and cache_ttl an optional lifetime in seconds. Cached results are frozensets.
+        thread_safe guards the graph with a reader-writer lock (see rwlock.py) so
+        that it can be read from many threads while others change it. """
+        # relationships partitioned by (rel category, other node category):
+        # node -> {(rel.category, targ.category): [(targ, rel), ...]}
+        self._outgoing = {}
+        # outgoing relationships: node -> [(targ, rel), ...], read from _outgoing
+        self.propertyGraph = _Adjacency(self._outgoing)
+        # node -> {(rel.category, src.category): [(src, rel), ...]}
+        self._incoming = {}
+        # set by freeze(): propertyGraph is then a read-only CSRGraph
+        self.frozen = False
+        # callables told about every change, see subscribe()
+        self._listeners = []
+        self._name_index = {}
+        self._category_index = {}
+        self._prop_index = {}
+        for key in indexed_keys or []:
+            self._prop_index[key] = {}
+        # query cache, invalidated by a version counter per node for adjacent()
+        # and a version of the set of nodes and their properties for get_nodes()
+        self._cache = None
+        self._versions = {}
+        self._nodes_version = 0
+        if cache_size:
+            from querycache import QueryCache
+            self._cache = QueryCache(cache_size, cache_policy, cache_ttl)
+        self._lock = None
+        if thread_safe:
+            self._make_thread_safe()
+
+    def _make_thread_safe(self):
+        """ Shadow the _READERS and _WRITERS methods with instance attributes that
+        hold the lock, so graphs that are not thread-safe pay nothing for it.
+        Readers never block each other; a writer waits for the readers in progress.
+        Generators can not hold the lock while their caller runs, so _neighbours
+        (and with it traverse and query) copies each node's neighbours under the lock. """
+        from rwlock import RWLock
+        self._lock = lock = RWLock()
+        for name in self._READERS:
+            setattr(self, name, _locked(getattr(self, name), lock.read))
+        for name in self._WRITERS:
+            setattr(self, name, _locked(getattr(self, name), lock.write))
+        neighbours = self._neighbours
+
+        def locked_neighbours(*args, **kwargs):
+            with lock.read:
+                return iter(list(neighbours(*args, **kwargs)))
+        self._neighbours = locked_neighbours
+
+    def read_lock(self):
+        """ Context manager holding the read lock of a thread-safe graph, for
+        iterating over it (e.g. with iter_lines) or making several consistent reads """
+        return self._lock.read if self._lock is not None else _NO_LOCK
+
+    def write_lock(self):
+        """ Context manager holding the write lock of a thread-safe graph,
+        for making several changes that readers should only see together """
+        return self._lock.write if self._lock is not None else _NO_LOCK
+
+    def cache_stats(self):
+        """ Return the query cache counters, or None when there is no cache """
+        return self._cache.stats() if self._cache is not None else None
+
+    def _touch(self, *nodes):
+        """ Invalidate the cached adjacent() results of nodes """
+        if self._cache is not None:
+            for node in nodes:
+                self._versions[node] = self._versions.get(node, 0) + 1
+
+    def create_index(self, key):
+        """ Start maintaining a (key, value) index for the property key,
+        indexing the nodes already in the graph """
+        if key in self._prop_index:
+            return
+        self._prop_index[key] = {}
+        for node in self.propertyGraph.keys():
+            if key in node._props.keys():
+                self._index_value(key, node._props[key], node)
+
+    def drop_index(self, key):
+        """ Stop maintaining the (key, value) index for the property key """
+        self._prop_index.pop(key, None)
+
+    def indexed_keys(self):
+        """ Return the list of property keys that are indexed """
+        return list(self._prop_index.keys())
+
+    def _index_value(self, key, value, node):
+        """ Add node to the index entry for (key, value). Unhashable
+        values can not be indexed and are found by scanning instead. """
+        try:
+            self._prop_index[key].setdefault(value, set()).add(node)
+        except TypeError:
+            pass
+
+    def _unindex_value(self, key, value, node):
+        """ Remove node from the index entry for (key, value) """
+        try:
+            bucket = self._prop_index[key].get(value)
+        except TypeError:
+            return
+        if bucket is not None:
+            bucket.discard(node)
+            if not bucket:
+                del self._prop_index[key][value]
+
+    def subscribe(self, listener):
+        """ Call listener(event, *args) after every change to the graph:
+        listener("add_node", node) when a node joins the graph,
+        listener("add_relationship", src, targ, rel) for every relationship,
+        listener("remove_relationship", src, targ, rel) when one is removed and
+        listener("set_property", node, key, value) when a node property is set.
+        A listener is called once the change it is told about is complete, so
+        the graph holds that change and nothing it has not been told about yet. """
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        """ Stop calling a listener registered with subscribe() """
+        self._listeners.remove(listener)
+
+    def _notify(self, event, *args):
+        for listener in self._listeners:
+            listener(event, *args)
+
+    def _add_adjacency(self, node):
+        """ Create the empty relationship lists of a node """
+        self._outgoing[node] = {}
+        self._incoming[node] = {}
+
+    def _register(self, node):
+        """ Index a node that has just become a key of the graph """
+        self._add_adjacency(node)
+        self._index_node(node)
+        self._nodes_version += 1
+        if self._listeners:
+            self._notify("add_node", node)
+
+    def _index_node(self, node):
+        """ Add a node to the name, category and property indexes """
+        # names are nearly all unique: a name maps to its node, and only
+        # becomes a set of nodes once a second node shares it
+        same_name = self._name_index.get(node.name)
+        if same_name is None:
+            self._name_index[node.name] = node
+        elif type(same_name) is set:
+            same_name.add(node)
+        else:
+            self._name_index[node.name] = {same_name, node}
+        self._category_index.setdefault(node.category, set()).add(node)
+        for key in self._prop_index.keys():
+            if key in node._props.keys():
+                self._index_value(key, node._props[key], node)
+        # weakref.ref(self) returns the same reference object for every node
+        ref = weakref.ref(self)
+        graphs = node._graphs
+        if graphs is None or type(graphs) is not list and graphs() is None:
+            node._graphs = ref
+        else:
+            graphs = [other for other in (graphs if type(graphs) is list else (graphs,)) if other() is not None]
+            graphs.append(ref)
+            node._graphs = graphs
+
+    def _named(self, name):
+        """ Return the nodes called name """
+        same_name = self._name_index.get(name)
+        if same_name is None:
+            return ()
+        return same_name if type(same_name) is set else (same_name,)
+
+    def _on_set_prop(self, node, key, old, value):
+        """ Called by a node of this graph to set one of its properties from old
+        (_UNSET if it was not set) to value, so that the value, the index and the
+        cached queries change together """
+        if key in self._prop_index:
+            if old is not _UNSET:
+                self._unindex_value(key, old, node)
+            self._index_value(key, value, node)
+        node.props[key] = value
+        self._nodes_version += 1
+        if self._listeners:
+            self._notify("set_property", node, key, value)
 
     def add_node(self, node):
-        """ Add a node to the property graph """
-        self.propertyGraph[node] = []
+        """ Add a node to the property graph.
+        Adding a node that is already in the graph keeps its relationships. """
+        self._check_mutable()
+        if node not in self._outgoing:
+            self._register(node)
 
     def add_relationship(self, src, targ, rel):
         """ Connect src and targ nodes via the specified directed relationship.
         If either src or targ nodes are not in the graph, add them.
         Note that there can be many relationships between two nodes! """
-        if src not in self.propertyGraph.keys():
-            self.propertyGraph[src] = []
-        if targ not in self.propertyGraph.keys():
-            self.propertyGraph[targ] = []
-        list_src = self.propertyGraph[src]
-        tup = (targ, rel)
-        list_src.append(tup)
-
-        self.propertyGraph[src] = list_src
+        self._check_mutable()
+        if src not in self._outgoing:
+            self._register(src)
+        if targ not in self._outgoing:
+            self._register(targ)
+        self._link(src, targ, rel)
+        if self._listeners:
+            self._notify("add_relationship", src, targ, rel)
+
+    def remove_relationship(self, src, targ, rel):
+        """ Remove one relationship from src to targ that uses the rel object.
+        Raises ValueError if there is no such relationship. The nodes stay in the graph. """
+        self._check_mutable()
+        if src not in self._outgoing:
+            raise ValueError(f"{src!r} is not in the graph")
+        if (targ, rel) not in self._outgoing[src].get((rel.category, targ.category), ()):
+            raise ValueError(f"{src!r} has no {rel!r} to {targ!r}")
+        self._unpartition(self._outgoing[src], (rel.category, targ.category), (targ, rel))
+        self._unpartition(self._incoming[targ], (rel.category, src.category), (src, rel))
+        self._touch(src, targ)
+        if self._listeners:
+            self._notify("remove_relationship", src, targ, rel)
+
+    @staticmethod
+    def _unpartition(partitions, key, relationship):
+        """ Remove a (node, rel) tuple from the partitions of one node """
+        partition = partitions[key]
+        partition.remove(relationship)
+        if not partition:
+            del partitions[key]
+
+    def bulk_load(self, nodes=(), edges=(), batch_size=10000):
+        """ Add many nodes and relationships at once.
+        nodes is an iterable of Node objects and edges an iterable of
+        (src, targ, rel) tuples; both are consumed lazily, batch_size at a time.
+        Equivalent to calling add_node and add_relationship for each of them. """
+        self._check_mutable()
+        nodes = iter(nodes)
+        while True:
+            batch = list(islice(nodes, batch_size))
+            if not batch:
+                break
+            self._load_batch(batch, ())
+        edges = iter(edges)
+        while True:
+            batch = list(islice(edges, batch_size))
+            if not batch:
+                break
+            self._load_batch((), batch)
+
+    def _load_batch(self, nodes, edges):
+        """ Add a batch of nodes then a batch of (src, targ, rel) relationships.
+        The relationships are grouped by node first so that every relationship
+        list grows by a single extend() per batch. """
+        self._check_mutable()
+        graph = self._outgoing
+        for node in nodes:
+            if node not in graph:
+                self._register(node)
+
+        if self._listeners:
+            # one relationship at a time, so that every listener call sees the
+            # graph exactly as after that relationship, see subscribe()
+            for src, targ, rel in edges:
+                if src not in graph:
+                    self._register(src)
+                if targ not in graph:
+                    self._register(targ)
+                self._link(src, targ, rel)
+                self._notify("add_relationship", src, targ, rel)
+            return
+
+        outgoing = {}
+        incoming = {}
+        for src, targ, rel in edges:
+            if src not in graph:
+                self._register(src)
+            if targ not in graph:
+                self._register(targ)
+            outgoing.setdefault(src, []).append((targ, rel))
+            incoming.setdefault(targ, []).append((src, rel))
+
+        self._touch(*outgoing.keys(), *incoming.keys())
+        for src, relationships in outgoing.items():
+            self._extend_partitions(self._outgoing[src], relationships)
+        for targ, relationships in incoming.items():
+            self._extend_partitions(self._incoming[targ], relationships)
+
+    @staticmethod
+    def _extend_partitions(partitions, relationships):
+        """ Add (node, rel) tuples to the partitions of one node """
+        grouped = {}
+        for relationship in relationships:
+            other, rel = relationship
+            grouped.setdefault(_partition_key(rel.category, other.category), []).append(relationship)
+        for key, group in grouped.items():
+            if key in partitions:
+                partitions[key].extend(group)
+            else:
+                partitions[key] = group
+
+    def _link(self, src, targ, rel):
+        """ Store a relationship between two nodes already in the graph """
+        self._outgoing[src].setdefault(_partition_key(rel.category, targ.category), []).append((targ, rel))
+        self._incoming[targ].setdefault(_partition_key(rel.category, src.category), []).append((src, rel))
+        self._touch(src, targ)
+
+    def _check_mutable(self):
+        """ Frozen graphs can not gain nodes or relationships """
+        if self.frozen:
+            raise RuntimeError("PropertyGraph is frozen, call thaw() before modifying it")
+
+    def freeze(self):
+        """ Move the relationships into compact, read-only CSR arrays (see csrgraph.py).
+        get_nodes and adjacent keep working; adding nodes or relationships
+        raises RuntimeError until thaw() is called. Requires numpy. """
+        if self.frozen:
+            return
+        from csrgraph import CSRGraph
+        self._use_compact(CSRGraph.from_adjacency(self.propertyGraph))
+
+    def _use_compact(self, compact):
+        """ Replace the relationship dictionaries with a CSRGraph """
+        self.propertyGraph = compact
+        self._outgoing = None
+        self._incoming = None
+        self.frozen = True
+
+    def thaw(self):
+        """ Move a frozen graph back to the mutable dictionary form """
+        if not self.frozen:
+            return
+        compact = self.propertyGraph
+        self._outgoing = {}
+        self._incoming = {}
+        self.propertyGraph = _Adjacency(self._outgoing)
+        for node in compact:
+            self._add_adjacency(node)
+        for src in compact:
+            for targ, rel in compact[src]:
+                self._link(src, targ, rel)
+        self.frozen = False
+
+    def save(self, path):
+        """ Write the graph to a snapshot directory, see snapshot.py """
+        from snapshot import save_snapshot
+        save_snapshot(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """ Read a frozen graph from a snapshot directory written by save().
+        With mmap the relationship arrays are memory-mapped rather than read,
+        so processes loading the same snapshot share one copy in the page cache. """
+        from snapshot import load_snapshot
+        return load_snapshot(path, mmap, cls)
 
 
 
     def get_nodes(self, name=None, category=None, key=None, value=None):
         """ Return the SET of nodes matching all the specified criteria.
-        If the criterion is None it means that the particular criterion is ignored. """
-        nodes = []
-        for node in self.propertyGraph.keys():
-            if name:
-                if node.name != name:
-                    continue
-            if category:
-                if node.category != category:
-                    continue
-            if key:
-                if key in node.props.keys():
-                    if node.props[key] != value:
-                        continue
-                else:
-                    continue
-            nodes.append(node)
-        return set(nodes)
-
-
-    def adjacent(self, node, node_category=None, rel_category=None):
+        If the criterion is None it means that the particular criterion is ignored.
+        Candidates come from the smallest matching index; criteria without an
+        index are checked on those candidates only. """
+        if self._cache is not None and _hashable(value):
+            return self._cached(("get_nodes", name, category, key, value), self._nodes_version,
+                                self._get_nodes, name, category, key, value)
+        return self._get_nodes(name, category, key, value)
+
+    def _cached(self, cache_key, version, compute, *args):
+        """ Return the cached result of compute(*args), computing it on a miss """
+        result = self._cache.get(cache_key, version)
+        if result is None:
+            result = frozenset(compute(*args))
+            self._cache.put(cache_key, version, result)
+        return result
+
+    def _get_nodes(self, name, category, key, value):
+        candidates = []
+        if name:
+            candidates.append(self._named(name))
+        if category:
+            candidates.append(self._category_index.get(category, ()))
+        if key and key in self._prop_index:
+            try:
+                candidates.append(self._prop_index[key].get(value, ()))
+            except TypeError:
+                pass
+
+        if candidates:
+            nodes = min(candidates, key=len)
+        else:
+            nodes = self.propertyGraph.keys()
+        return {node for node in nodes if self._matches(node, name, category, key, value)}
+
+    def estimate_nodes(self, name=None, category=None, key=None, value=None):
+        """ Return an upper bound on the number of nodes get_nodes would return
+        for the same criteria: the size of the smallest matching index,
+        or the number of nodes when no index applies """
+        sizes = [len(self.propertyGraph)]
+        if name:
+            sizes.append(len(self._named(name)))
+        if category:
+            sizes.append(len(self._category_index.get(category, ())))
+        if key and key in self._prop_index:
+            try:
+                sizes.append(len(self._prop_index[key].get(value, ())))
+            except TypeError:
+                pass
+        return min(sizes)
+
+    def query(self, text):
+        """ Run a pattern query, see query.py, yielding one dictionary per match """
+        from query import Query
+        return Query(text).run(self)
+
+    @staticmethod
+    def _matches(node, name, category, key, value):
+        """ Check a single node against the get_nodes criteria """
+        if name:
+            if node.name != name:
+                return False
+        if category:
+            if node.category != category:
+                return False
+        if key:
+            if key in node._props.keys():
+                if node._props[key] != value:
+                    return False
+            else:
+                return False
+        return True
+
+
+    def adjacent(self, node, node_category=None, rel_category=None, direction="out"):
         """ Return a set of all nodes that are adjacent to node.
         If specified include only adjacent nodes with the specified node_category.
         If specified include only adjacent nodes connected via relationships with
-        the specified rel_category """
-        related_nodes = []
-        for relationship in self.propertyGraph[node]:
-            node_adjacent = relationship[0]
-            relationship_adjacent = relationship[1]
-            if node_category:
-                if node_adjacent.category != node_category:
+        the specified rel_category.
+        direction is "out" for relationships leaving node, "in" for relationships
+        pointing at node or "both" """
+        if self._cache is not None:
+            return self._cached(("adjacent", node, node_category, rel_category, direction),
+                                self._versions.get(node, 0),
+                                self._adjacent, node, node_category, rel_category, direction)
+        return self._adjacent(node, node_category, rel_category, direction)
+
+    def _adjacent(self, node, node_category, rel_category, direction):
+        if self.frozen:
+            return self.propertyGraph.adjacent(node, node_category, rel_category, direction)
+        related_nodes = set()
+        for relationships in self._partitions(node, node_category, rel_category, direction):
+            related_nodes.update(relationships)
+        return related_nodes
+
+    def _neighbours(self, node, node_category=None, rel_category=None, direction="out"):
+        """ Yield the (node, rel) tuples of adjacent() one at a time """
+        if self.frozen:
+            compact = self.propertyGraph
+            node_ids, rel_ids = compact.neighbours(compact.ids[node], node_category, rel_category, direction)
+            for n, r in zip(node_ids.tolist(), rel_ids.tolist()):
+                yield compact.nodes[n], compact.rels[r]
+            return
+        for relationships in self._partitions(node, node_category, rel_category, direction):
+            yield from relationships
+
+    def traverse(self, start, pattern=None, max_depth=None, direction="out", order="bfs", limit=None,
+                 rel_category=None, node_category=None):
+        """ Lazily yield the paths leaving start as tuples (start, rel, node, rel, node, ...).
+        pattern is a list of (rel_category, node_category) pairs, one per hop, where
+        None matches any category; only paths matching the whole pattern are yielded.
+        Without a pattern every path to a newly reached node is yielded, following
+        only rel_category relationships to node_category nodes if they are given.
+        max_depth limits the number of hops, order is "bfs" or "dfs" and
+        traversal stops once limit paths were yielded.
+        Each node is reached once (once per hop when following a pattern),
+        so a node found through several paths is only yielded for the first one. """
+        if order not in ("bfs", "dfs"):
+            raise ValueError(f'order must be "bfs" or "dfs", not {order!r}')
+        depth_limit = len(pattern) if pattern else max_depth
+        if pattern and max_depth is not None:
+            depth_limit = min(depth_limit, max_depth)
+        if depth_limit is not None and depth_limit < 1:
+            return
+
+        frontier = deque([(start,)])
+        visited = {(0, start)} if pattern else {start}
+        found = 0
+        while frontier:
+            path = frontier.popleft() if order == "bfs" else frontier.pop()
+            depth = len(path) // 2
+            hop_rel, hop_node = pattern[depth] if pattern else (rel_category, node_category)
+            for other, rel in self._neighbours(path[-1], hop_node, hop_rel, direction):
+                key = (depth + 1, other) if pattern else other
+                if key in visited:
+                    continue
+                visited.add(key)
+                new_path = path + (rel, other)
+                if not pattern or depth + 1 == len(pattern):
+                    yield new_path
+                    found += 1
+                    if limit and found >= limit:
+                        return
+                if depth_limit is None or depth + 1 < depth_limit:
+                    frontier.append(new_path)
+
+    def _partitions(self, node, node_category=None, rel_category=None, direction="out"):
+        """ Yield the relationship lists of node that match the node and
+        relationship categories, without looking at the relationships of other categories """
+        if direction == "out":
+            partitions = [self._outgoing[node]]
+        elif direction == "in":
+            partitions = [self._incoming[node]]
+        elif direction == "both":
+            partitions = [self._outgoing[node], self._incoming[node]]
+        else:
+            raise ValueError(f'direction must be "in", "out" or "both", not {direction!r}')
+
+        for partition in partitions:
+            if rel_category and node_category:
+                relationships = partition.get((rel_category, node_category))
+                if relationships:
+                    yield relationships
+                continue
+            for (rel_cat, node_cat), relationships in partition.items():
+                if rel_category and rel_cat != rel_category:
                     continue
-            if rel_category:
-                if relationship_adjacent.category != rel_category:
+                if node_category and node_cat != node_category:
                     continue
-            related_nodes.append((node_adjacent, relationship_adjacent))
-        return set(related_nodes)
+                yield relationships
 
 
     def subgraph(self, nodes):
         """ Return the subgraph as a PropertyGraph consisting of the specified
         set of nodes and all interconnecting relationships """
-        subgraph = PropertyGraph()
-        for node in nodes:
-            subgraph.propertyGraph[node]= []
+        nodes = list(dict.fromkeys(nodes))
+        members = set(nodes)
+        relationships = ((src, targ, rel)
+                         for src in nodes if src in self.propertyGraph
+                         for targ, rel in self.propertyGraph[src] if targ in members)
+        subgraph = PropertyGraph(self.indexed_keys())
+        subgraph.bulk_load(nodes, relationships)
         return subgraph
 
+    def subgraph_view(self, nodes):
+        """ Return a read-only SubgraphView of the specified nodes: like subgraph()
+        but nothing is copied, queries are answered by filtering this graph """
+        return SubgraphView(self, nodes)
 
-    def __repr__(self):
-        """ A string representation of the property graph
-        Properties are not displaced.
+
+    def num_relationships(self):
+        """ Return the number of relationships in the graph """
+        if self.frozen:
+            return self.propertyGraph.num_edges()
+        return sum(len(relationships) for partitions in self._outgoing.values() for relationships in partitions.values())
+
+    def iter_lines(self):
+        """ Yield the graph as lines of text, one node at a time.
+        Properties are not displayed.
+        On a thread-safe graph, hold read_lock() while iterating.
 
         Node
             Relationship Node
@@ -174,7 +802,6 @@ class PropertyGraph:
             .
             etc.
         Node
-            Relationship Node
             Relationship Node
             .
             .
@@ -183,16 +810,87 @@ class PropertyGraph:
         .
         etc.
         """
-        list_nodes = list(self.propertyGraph.keys())
-        for src in list_nodes:
-            information = self.propertyGraph[src]
-            grouped_info = (src, information)
+        for src in self.propertyGraph:
+            yield f'Node({src.name}:{src.category})'
+            for targ, rel in self.propertyGraph[src]:
+                yield f'    Relationship({rel.category}) Node({targ.name}:{targ.category})'
+
+    def write(self, file, fmt="text", chunk_size=1000):
+        """ Stream the graph to an open file object as "text" (iter_lines),
+        "jsonl" (readable by graphio.load_jsonl) or "graphml", see graphio.py """
+        from graphio import write_graph
+        write_graph(self, file, fmt, chunk_size)
+
+    def __repr__(self):
+        """ A short string representation of the property graph:
+        the node and relationship counts and the first few nodes """
+        with self.read_lock():
+            sample = list(islice(self.propertyGraph, 3))
+            more = ', ...' if len(self.propertyGraph) > len(sample) else ''
+            return (f'PropertyGraph({len(self.propertyGraph)} nodes, {self.num_relationships()} relationships: '
+                    f'{", ".join(map(repr, sample))}{more})')
+
+
+
+class _ViewAdjacency(Mapping):
+    """ The propertyGraph mapping of a SubgraphView, filtered on demand """
+
+    def __init__(self, view):
+        self.view = view
+
+    def __getitem__(self, node):
+        if node not in self.view.nodes:
+            raise KeyError(node)
+        return [(targ, rel) for targ, rel in self.view.graph.propertyGraph[node] if targ in self.view.nodes]
 
+    def __contains__(self, node):
+        return node in self.view.nodes
 
-        return f'({grouped_info})'
+    def __iter__(self):
+        return iter(self.view.nodes)
 
+    def __len__(self):
+        return len(self.view.nodes)
 
 
 
+class SubgraphView:
 
+    def __init__(self, graph, nodes):
+        """ A read-only view of the subgraph induced by nodes: the nodes that
+        are in graph, and the relationships of graph between them.
+        Changes to graph show through the view. """
+        self.graph = graph
+        self.nodes = {node for node in nodes if node in graph.propertyGraph}
+        self.propertyGraph = _ViewAdjacency(self)
 
+    def get_nodes(self, name=None, category=None, key=None, value=None):
+        """ Same as PropertyGraph.get_nodes, limited to the nodes of the view """
+        if not (name or category or key):
+            return set(self.nodes)
+        return {node for node in self.graph.get_nodes(name, category, key, value) if node in self.nodes}
+
+    def estimate_nodes(self, name=None, category=None, key=None, value=None):
+        """ Same as PropertyGraph.estimate_nodes, limited to the nodes of the view """
+        return min(len(self.nodes), self.graph.estimate_nodes(name, category, key, value))
+
+    def adjacent(self, node, node_category=None, rel_category=None, direction="out"):
+        """ Same as PropertyGraph.adjacent, limited to relationships inside the view """
+        return set(self._neighbours(node, node_category, rel_category, direction))
+
+    def _neighbours(self, node, node_category=None, rel_category=None, direction="out"):
+        if node not in self.nodes:
+            raise KeyError(node)
+        for other, rel in self.graph._neighbours(node, node_category, rel_category, direction):
+            if other in self.nodes:
+                yield other, rel
+
+    traverse = PropertyGraph.traverse
+    query = PropertyGraph.query
+
+    def materialize(self):
+        """ Copy the view into a PropertyGraph """
+        return self.graph.subgraph(self.nodes)
+
+    def __repr__(self):
+        return f'SubgraphView({len(self.nodes)} nodes)'
@@ -0,0 +1,294 @@
+"""
+File: query.py
+Description: A small Cypher-like pattern query language for a PropertyGraph.
+
+    MATCH (x:Person {name: 'Spencer'})<-[:known]-(p:Person)-[:bought]->(b:Book)
+    WHERE b.Price > 100
+    RETURN p, b
+
+A query is one chain of node patterns (var:Category {key: value, ...})
+joined by relationship patterns -[var:category {key: value}]->, <-[...]-
+or -[...]- (either direction); every part of a pattern is optional.
+The name key matches the node name, other keys match properties.
+WHERE takes var.key comparisons (=, <>, !=, <, <=, >, >=) joined by AND.
+RETURN lists the variables to return, all named variables by default.
+Categories containing spaces are written in backticks: (:`Literary Fiction`).
+
+The planner starts from the node pattern with the fewest candidate nodes
+according to the graph's name, category and property indexes, then expands
+the chain outwards from there.  Matches are produced by a pipeline of
+generators, so the first results arrive before the whole graph is searched.
+
+"""
+
+import operator
+import re
+
+from propertygraph import Node
+
+_LABEL = r"(?::\s*(?P<label>`[^`]*`|\w+))?"
+_PROPS = r"(?P<props>\{[^}]*\})?"
+_NODE = re.compile(r"\s*\(\s*(?P<var>\w+)?\s*" + _LABEL + r"\s*" + _PROPS + r"\s*\)")
+_REL = re.compile(r"\s*(?P<left><)?-(?:\[\s*(?P<var>\w+)?\s*" + _LABEL + r"\s*" + _PROPS + r"\s*\])?-(?P<right>>)?")
+_LITERAL = r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|true|false|null"""
+_PROP = re.compile(r"\s*(\w+)\s*:\s*(" + _LITERAL + r")\s*(,|$)")
+_CONDITION = re.compile(r"\s*(\w+)\.(\w+)\s*(<>|!=|<=|>=|=|<|>)\s*(" + _LITERAL + r")\s*(?:AND\b|(?=RETURN\b|$))", re.IGNORECASE)
+
+_COMPARISONS = {"=": operator.eq, "<>": operator.ne, "!=": operator.ne, "<": operator.lt,
+                "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+_REVERSED = {"out": "in", "in": "out", "both": "both"}
+
+
+def _literal(text):
+    """ Convert a literal of the query language to a Python value """
+    if text[0] in "'\"":
+        return re.sub(r"\\(.)", r"\1", text[1:-1])
+    if text in ("true", "false", "null"):
+        return {"true": True, "false": False, "null": None}[text]
+    if re.fullmatch(r"[-+]?\d+", text):
+        return int(text)
+    return float(text)
+
+
+def _props(text):
+    """ Parse a {key: value, ...} map """
+    props = {}
+    if not text:
+        return props
+    body = text[1:-1].strip()
+    pos = 0
+    while pos < len(body):
+        match = _PROP.match(body, pos)
+        if not match:
+            raise ValueError(f"can not parse property map {text!r}")
+        props[match.group(1)] = _literal(match.group(2))
+        pos = match.end()
+    return props
+
+
+def _label(match):
+    label = match.group("label")
+    return label.strip("`") if label else None
+
+
+class NodePattern:
+
+    def __init__(self, var, category, props):
+        """ Class constructor: the name key of props is the node name """
+        self.var = var
+        self.category = category
+        self.name = props.pop("name", None)
+        self.props = props
+
+    def matches(self, node):
+        """ Check a node against the pattern """
+        if self.category is not None and node.category != self.category:
+            return False
+        if self.name is not None and node.name != self.name:
+            return False
+        for key, value in self.props.items():
+            if key not in node._props or node._props[key] != value:
+                return False
+        return True
+
+    def __repr__(self):
+        return f"({self.var}:{self.category})"
+
+
+class RelPattern:
+
+    def __init__(self, var, category, props, direction):
+        """ Class constructor, direction is "out", "in" or "both" read left to right """
+        self.var = var
+        self.category = category
+        self.props = props
+        self.direction = direction
+
+    def matches(self, rel):
+        """ Check a relationship against the pattern """
+        return all(rel[key] == value for key, value in self.props.items())
+
+    def __repr__(self):
+        arrows = {"out": ("-", "->"), "in": ("<-", "-"), "both": ("-", "-")}[self.direction]
+        return f"{arrows[0]}[{self.var or ''}:{self.category}]{arrows[1]}"
+
+
+class Condition:
+
+    def __init__(self, var, key, op, value):
+        self.var = var
+        self.key = key
+        self.op = op
+        self.value = value
+
+    def holds(self, binding):
+        """ Evaluate the condition; comparisons with missing properties are false """
+        obj = binding[self.var]
+        if self.key == "category":
+            actual = obj.category
+        elif self.key == "name" and isinstance(obj, Node):
+            actual = obj.name
+        else:
+            actual = obj[self.key]
+        if actual is None:
+            return False
+        try:
+            return _COMPARISONS[self.op](actual, self.value)
+        except TypeError:
+            return False
+
+    def __repr__(self):
+        return f"{self.var}.{self.key} {self.op} {self.value!r}"
+
+
+class Query:
+
+    def __init__(self, text):
+        """ Parse a query, raising ValueError if it is not valid """
+        self.text = text
+        self.nodes = []
+        self.rels = []
+        self.conditions = []
+
+        match = re.match(r"\s*(?:MATCH\b)?", text, re.IGNORECASE)
+        pos = self._parse_chain(text, match.end())
+
+        match = re.compile(r"\s*WHERE\b", re.IGNORECASE).match(text, pos)
+        if match:
+            pos = match.end()
+            while True:
+                match = _CONDITION.match(text, pos)
+                if not match:
+                    break
+                var, key, op, value = match.groups()
+                self.conditions.append(Condition(var, key, op, _literal(value)))
+                pos = match.end()
+            if not self.conditions:
+                raise ValueError(f"can not parse WHERE clause of {text!r}")
+
+        variables = [pattern.var for pattern in self.nodes + self.rels if not pattern.var.startswith("_")]
+        match = re.compile(r"\s*RETURN\s+(\w+(?:\s*,\s*\w+)*)", re.IGNORECASE).match(text, pos)
+        if match:
+            self.returns = [var.strip() for var in match.group(1).split(",")]
+            pos = match.end()
+        else:
+            self.returns = list(dict.fromkeys(variables))
+
+        if text[pos:].strip():
+            raise ValueError(f"can not parse {text[pos:].strip()!r} in {text!r}")
+        for var in self.returns + [condition.var for condition in self.conditions]:
+            if var not in variables:
+                raise ValueError(f"unknown variable {var!r} in {text!r}")
+
+    def _parse_chain(self, text, pos):
+        """ Parse the (node)-[rel]->(node)... chain starting at pos """
+        while True:
+            match = _NODE.match(text, pos)
+            if not match:
+                raise ValueError(f"expected a node pattern at {text[pos:]!r}")
+            var = match.group("var") or f"_n{len(self.nodes)}"
+            self.nodes.append(NodePattern(var, _label(match), _props(match.group("props"))))
+            pos = match.end()
+
+            match = _REL.match(text, pos)
+            if not match:
+                return pos
+            if match.group("left") and match.group("right"):
+                raise ValueError(f"relationship pattern points both ways in {text!r}")
+            direction = "in" if match.group("left") else "out" if match.group("right") else "both"
+            var = match.group("var") or f"_r{len(self.rels)}"
+            self.rels.append(RelPattern(var, _label(match), _props(match.group("props")), direction))
+            pos = match.end()
+
+    def _equalities(self, pattern):
+        """ The name and property values a node pattern requires, including WHERE equalities """
+        name = pattern.name
+        props = dict(pattern.props)
+        for condition in self.conditions:
+            if condition.var == pattern.var and condition.op == "=":
+                if condition.key == "name":
+                    name = condition.value
+                elif condition.key != "category":
+                    props[condition.key] = condition.value
+        return name, props
+
+    def _estimate(self, graph, pattern):
+        """ Return (estimated candidates, property key to look up) for a node pattern """
+        name, props = self._equalities(pattern)
+        best = (graph.estimate_nodes(name, pattern.category), None)
+        for key, value in props.items():
+            best = min(best, (graph.estimate_nodes(name, pattern.category, key, value), key),
+                       key=lambda estimate: estimate[0])
+        return best
+
+    def plan(self, graph):
+        """ Return (start index, estimates): the node pattern with the fewest
+        candidates and the estimated candidates of every node pattern """
+        estimates = [self._estimate(graph, pattern)[0] for pattern in self.nodes]
+        return estimates.index(min(estimates)), estimates
+
+    def explain(self, graph):
+        """ Describe the plan chosen for graph as a list of lines """
+        start, estimates = self.plan(graph)
+        lines = [f"start at {self.nodes[start]!r}, ~{estimates[start]} candidate nodes"]
+        for i, rel, other in self._expansions(start):
+            lines.append(f"expand {self.nodes[i]!r} {rel!r} {self.nodes[other]!r}")
+        if self.conditions:
+            lines.append(f"filter {' AND '.join(map(repr, self.conditions))}")
+        return lines
+
+    def _expansions(self, start):
+        """ (from node index, rel pattern, to node index) in the order they are executed:
+        rightwards from the start, then leftwards """
+        steps = [(i, self.rels[i], i + 1) for i in range(start, len(self.rels))]
+        steps += [(i, self.rels[i - 1], i - 1) for i in range(start, 0, -1)]
+        return steps
+
+    def run(self, graph):
+        """ Yield a dictionary of the returned variables for every match """
+        start, _ = self.plan(graph)
+        pattern = self.nodes[start]
+        name, props = self._equalities(pattern)
+        _, key = self._estimate(graph, pattern)
+
+        # every condition is checked as soon as its variable is bound
+        pending = list(self.conditions)
+
+        def ready(var):
+            nonlocal pending
+            now = [condition for condition in pending if condition.var == var]
+            pending = [condition for condition in pending if condition.var != var]
+            return now
+
+        start_conditions = ready(pattern.var)
+        candidates = graph.get_nodes(name, pattern.category, key, props.get(key))
+        bindings = (
+            {pattern.var: node} for node in candidates
+            if pattern.matches(node) and all(condition.holds({pattern.var: node}) for condition in start_conditions)
+        )
+
+        for i, rel, other in self._expansions(start):
+            direction = rel.direction if other > i else _REVERSED[rel.direction]
+            bindings = self._expand(graph, bindings, self.nodes[i], rel, self.nodes[other], direction,
+                                    ready(rel.var) + ready(self.nodes[other].var))
+
+        for binding in bindings:
+            yield {var: binding[var] for var in self.returns}
+
+    @staticmethod
+    def _expand(graph, bindings, source, rel, target, direction, conditions):
+        """ Extend every binding through one relationship pattern """
+        for binding in bindings:
+            bound = binding.get(target.var)
+            for node, relationship in graph._neighbours(binding[source.var], target.category,
+                                                        rel.category, direction):
+                if bound is not None and node != bound:
+                    continue
+                if not target.matches(node) or not rel.matches(relationship):
+                    continue
+                extended = dict(binding)
+                extended[target.var] = node
+                extended[rel.var] = relationship
+                if all(condition.holds(extended) for condition in conditions):
+                    yield extended
@@ -0,0 +1,72 @@
+"""
+File: querycache.py
+Description: A bounded cache for PropertyGraph query results.
+Every entry is stored with the version of the graph data it was computed
+from; a lookup with a different version is a miss, so results are
+invalidated exactly when the nodes they depend on change.
+The cache is safe to use from several threads.
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+
+    def __init__(self, maxsize=1024, policy="lru", ttl=None, clock=time.monotonic):
+        """ Class constructor.
+        maxsize - number of results kept
+        policy - "lru" evicts the least recently used result, "fifo" the oldest one
+        ttl - optional number of seconds after which a result expires
+        clock - function returning the current time in seconds """
+        if policy not in ("lru", "fifo"):
+            raise ValueError(f'policy must be "lru" or "fifo", not {policy!r}')
+        self.maxsize = maxsize
+        self.policy = policy
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._mutex = threading.Lock()
+
+    def get(self, key, version):
+        """ Return the result cached for key at this version, or None """
+        with self._mutex:
+            return self._get(key, version)
+
+    def _get(self, key, version):
+        entry = self._entries.get(key)
+        if entry is not None:
+            result, cached_version, expires = entry
+            if cached_version == version and (expires is None or self.clock() < expires):
+                self.hits += 1
+                if self.policy == "lru":
+                    self._entries.move_to_end(key)
+                return result
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, version, result):
+        """ Cache the result computed for key at this version """
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self._mutex:
+            self._entries[key] = (result, version, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """ Drop every cached result, keeping the counters """
+        with self._mutex:
+            self._entries.clear()
+
+    def stats(self):
+        """ Return the hit, miss and eviction counters and the current size """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "size": len(self._entries), "maxsize": self.maxsize}
@@ -5,38 +5,67 @@ A Recommendation system to use on a property graph database. Hardcodes in a Prop
 based on relationships within the property graph
 '''
 
+import heapq
+import sys
+
 from propertygraph import Node
 from propertygraph import Relationship
 from propertygraph import PropertyGraph
 '''
 
 Original Property Graph: 
-{Node(Emily:Person): [(Node(Spencer:Person), Relationship(known)), (Node(Database Design:Book     {'Price': 195.0}), Relationship(bought))],
-Node(Spencer:Person): [(Node(Emily:Person), Relationship(known)), (Node(Brendan:Person), Relationship(known)), (Node(Cosmos:Book     {'Price': 17.0}), Relationship(bought)), (Node(Database Design:Book     {'Price': 195.0}), Relationship(bought))], 
-Node(Brendan:Person): [(Node(DNA and You:Book     {'Price': 11.5}), Relationship(bought)), (Node(Database Design:Book     {'Price': 195.0}), Relationship(bought))], 
-Node(Database Design:Book     {'Price': 195.0}): [], 
-Node(Cosmos:Book     {'Price': 17.0}): [], 
-Node(DNA and You:Book     {'Price': 11.5}): [], 
-Node(Trevor:Person): [(Node(Cosmos:Book     {'Price': 17.0}), Relationship(bought)), (Node(Database Design:Book     {'Price': 195.0}), Relationship(bought))], 
-Node(Paxtyn:Person): [(Node(Database Design:Book     {'Price': 195.0}), Relationship(bought)), (Node(The Life of Cronkite:Book     {'Price': 29.95}), Relationship(bought))], 
-Node(The Life of Cronkite:Book     {'Price': 29.95}): []}
+Node(Emily:Person)
+    Relationship(known) Node(Spencer:Person)
+    Relationship(bought) Node(Database Design:Book)
+Node(Spencer:Person)
+    Relationship(known) Node(Emily:Person)
+    Relationship(known) Node(Brendan:Person)
+    Relationship(bought) Node(Cosmos:Book)
+    Relationship(bought) Node(Database Design:Book)
+Node(Brendan:Person)
+    Relationship(bought) Node(DNA and You:Book)
+    Relationship(bought) Node(Database Design:Book)
+Node(Database Design:Book)
+Node(Cosmos:Book)
+Node(DNA and You:Book)
+Node(Trevor:Person)
+    Relationship(bought) Node(Cosmos:Book)
+    Relationship(bought) Node(Database Design:Book)
+Node(Paxtyn:Person)
+    Relationship(bought) Node(Database Design:Book)
+    Relationship(bought) Node(The Life of Cronkite:Book)
+Node(The Life of Cronkite:Book)
 
 
 Spencer's Recommendation subgraph: 
-{Node(Spencer:Person): [(Node(DNA and You:Book     {'Price': 11.5}), Relationship(Recommendation))], 
-Node(DNA and You:Book     {'Price': 11.5}): []}
+Node(Spencer:Person)
+    Relationship(Recommendation) Node(DNA and You:Book)
+Node(DNA and You:Book)
 
 
 Added Recommendation to the Property Graph: 
-{Node(Emily:Person): [(Node(Spencer:Person), Relationship(known)), (Node(Database Design:Book     {'Price': 195.0}), Relationship(bought))], 
-Node(Spencer:Person): [(Node(Emily:Person), Relationship(known)), (Node(Brendan:Person), Relationship(known)), (Node(Cosmos:Book     {'Price': 17.0}), Relationship(bought)), (Node(Database Design:Book     {'Price': 195.0}), Relationship(bought)), (Node(DNA and You:Book     {'Price': 11.5}), Relationship(Recommendation))], 
-Node(Brendan:Person): [(Node(DNA and You:Book     {'Price': 11.5}), Relationship(bought)), (Node(Database Design:Book     {'Price': 195.0}), Relationship(bought))], 
-Node(Database Design:Book     {'Price': 195.0}): [],
- Node(Cosmos:Book     {'Price': 17.0}): [], 
- Node(DNA and You:Book     {'Price': 11.5}): [], 
- Node(Trevor:Person): [(Node(Cosmos:Book     {'Price': 17.0}), Relationship(bought)), (Node(Database Design:Book     {'Price': 195.0}), Relationship(bought))], 
- Node(Paxtyn:Person): [(Node(Database Design:Book     {'Price': 195.0}), Relationship(bought)), (Node(The Life of Cronkite:Book     {'Price': 29.95}), Relationship(bought))], 
- Node(The Life of Cronkite:Book     {'Price': 29.95}): []}
+Node(Emily:Person)
+    Relationship(known) Node(Spencer:Person)
+    Relationship(bought) Node(Database Design:Book)
+Node(Spencer:Person)
+    Relationship(known) Node(Emily:Person)
+    Relationship(known) Node(Brendan:Person)
+    Relationship(bought) Node(Cosmos:Book)
+    Relationship(bought) Node(Database Design:Book)
+    Relationship(Recommendation) Node(DNA and You:Book)
+Node(Brendan:Person)
+    Relationship(bought) Node(DNA and You:Book)
+    Relationship(bought) Node(Database Design:Book)
+Node(Database Design:Book)
+Node(Cosmos:Book)
+Node(DNA and You:Book)
+Node(Trevor:Person)
+    Relationship(bought) Node(Cosmos:Book)
+    Relationship(bought) Node(Database Design:Book)
+Node(Paxtyn:Person)
+    Relationship(bought) Node(Database Design:Book)
+    Relationship(bought) Node(The Life of Cronkite:Book)
+Node(The Life of Cronkite:Book)
 
 Process finished with exit code 0
 
@@ -51,22 +80,374 @@ def recommend(og_person, og_graph, rel):
     and the book recommendations
     '''
     subgraph = og_graph.subgraph([og_person])
-    relationship_knows = og_graph.adjacent(node=og_person, node_category="Person", rel_category="known")
 
-    bought_books = og_graph.adjacent(node=og_person, node_category="Book")
+    bought_books = {book for book, _ in og_graph.adjacent(node=og_person, node_category="Book")}
 
+    # books bought by the people the person knows, each book found once
     book_recs = []
-    for person in relationship_knows:
-        person_node = person[0]
-        books = og_graph.adjacent(node=person_node, node_category="Book", rel_category="bought")
+    for path in og_graph.traverse(og_person, pattern=[("known", "Person"), ("bought", "Book")]):
+        book = path[-1]
         # filter out the books that the person already has
-        for book in books:
-            if book in bought_books:
+        if book in bought_books:
+            continue
+        subgraph.add_relationship(og_person, book, rel = rel)
+        book_recs.append(book)
+    return subgraph, book_recs
+
+def recommend_top_k(og_person, og_graph, k=10, hops=2, decay=0.5, weight_key=None):
+    '''
+    Returns the k best book recommendations for a person as [(book, score), ...], best first. Every person within
+    hops "known" relationships adds decay ** (distance - 1) to the score of each book they bought, multiplied by the
+    book's weight_key property if given (books without it score 0). Books the person already has are skipped.
+    Only the per-book scores are kept while walking the neighborhood, and the top k come from a heap of size k
+    '''
+    owned = {book for book, _ in og_graph.adjacent(node=og_person, node_category="Book")}
+
+    scores = {}
+    for path in og_graph.traverse(og_person, max_depth=hops, rel_category="known", node_category="Person"):
+        weight = decay ** (len(path) // 2 - 1)
+        # a person buying the same book twice still counts once
+        for book in {book for book, _ in og_graph.adjacent(node=path[-1], node_category="Book", rel_category="bought")}:
+            if book in owned:
+                continue
+            value = weight
+            if weight_key:
+                value *= book[weight_key] or 0
+            scores[book] = scores.get(book, 0) + value
+
+    return heapq.nlargest(k, scores.items(), key=lambda rec: rec[1])
+
+def recommend_pagerank(og_person, og_graph, k=10, damping=0.85):
+    '''
+    Returns the k books with the highest personalized PageRank from a person over the known and bought relationships,
+    as [(book, score), ...] best first, skipping the books the person already has. Unlike recommend it reaches past the
+    person's direct friends and favours books bought by many well connected people
+    '''
+    from analytics import pagerank
+    owned = {book for book, _ in og_graph.adjacent(node=og_person, node_category="Book")}
+    scores = pagerank(og_graph, damping, personalization=og_person, rel_categories=["known", "bought"])
+    books = ((node, score) for node, score in scores.items()
+             if node.category == "Book" and node not in owned and score > 0)
+    return heapq.nlargest(k, books, key=lambda rec: rec[1])
+
+def relationship_matrix(og_graph, rows, cols, rel_category=None):
+    '''
+    Builds a sparse len(rows) x len(cols) matrix with a 1 where a row node has a relationship of the rel_category (any
+    relationship if None) to a column node. Frozen graphs are read straight from their CSR arrays
+    '''
+    import numpy as np
+
+    if og_graph.frozen:
+        compact = og_graph.propertyGraph
+        # position of every node id in cols, -1 for nodes that are not in them
+        col_of = np.full(len(compact), -1, dtype=np.int64)
+        col_of[[compact.ids[node] for node in cols]] = np.arange(len(cols))
+        rel_mask = None
+        if rel_category:
+            rel_mask = compact.rel_codes == compact.rel_categories.get(rel_category, -1)
+        edge_rows, targets = _row_edges(compact.offsets, compact.targets, compact.rel_ids,
+                                        [compact.ids[node] for node in rows], rel_mask)
+        edge_cols = col_of[targets]
+        keep = edge_cols >= 0
+        return _binary_matrix(edge_rows[keep], edge_cols[keep], (len(rows), len(cols)))
+
+    row_index = {node: i for i, node in enumerate(rows)}
+    col_index = {node: i for i, node in enumerate(cols)}
+    edge_rows = []
+    edge_cols = []
+    for node in rows:
+        for other, _ in og_graph.adjacent(node, rel_category=rel_category):
+            if other in col_index:
+                edge_rows.append(row_index[node])
+                edge_cols.append(col_index[other])
+
+    return _binary_matrix(edge_rows, edge_cols, (len(rows), len(cols)))
+
+def _row_edges(offsets, targets, rel_ids, row_ids, rel_mask=None):
+    '''
+    Reads the relationships of the node ids row_ids straight from CSR arrays, touching only their edges. rel_mask keeps
+    the relationships of the rel ids where it is True (all relationships if None). Returns the arrays (row, target)
+    of the relationships, row being the position of the source in row_ids
+    '''
+    import numpy as np
+
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    starts = np.asarray(offsets[row_ids], dtype=np.int64)
+    counts = np.asarray(offsets[row_ids + 1], dtype=np.int64) - starts
+    # positions of the edges of every row in targets/rel_ids
+    edge_rows = np.repeat(np.arange(len(row_ids)), counts)
+    edges = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    if rel_mask is None:
+        return edge_rows, np.asarray(targets[edges], dtype=np.int64)
+    keep = rel_mask[rel_ids[edges]]
+    return edge_rows[keep], np.asarray(targets[edges[keep]], dtype=np.int64)
+
+def _binary_matrix(rows, cols, shape):
+    '''
+    Builds a sparse matrix of the given shape with a 1 at every (row, col)
+    '''
+    import numpy as np
+    from scipy import sparse
+
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape)
+    # several relationships between the same two nodes count once
+    matrix.data[:] = 1
+    return matrix
+
+def recommend_all(og_graph, person_category="Person", book_category="Book", owned_category=None):
+    '''
+    Computes the book recommendations of every person at once with sparse matrix products: the books bought by the
+    people a person knows, minus the books the person already has (any relationship to the book as in recommend, or
+    only owned_category relationships if given). Returns a dictionary of person -> [(book, score), ...] sorted by
+    score, the number of people the person knows who bought the book
+    '''
+    people = list(og_graph.get_nodes(category=person_category))
+    books = list(og_graph.get_nodes(category=book_category))
+    matrices = recommendation_matrices(og_graph, people, books, owned_category)
+    return score_rows(matrices, people, books, 0, len(people))
+
+def recommendation_matrices(og_graph, people, books, owned_category=None):
+    '''
+    Builds the (knows, bought, has) matrices used by recommend_all for the given lists of people and books
+    '''
+    knows = relationship_matrix(og_graph, people, people, "known")
+    bought = relationship_matrix(og_graph, people, books, "bought")
+    has = relationship_matrix(og_graph, people, books, owned_category)
+    return knows, bought, has
+
+def score_rows(matrices, people, books, start, stop):
+    '''
+    Computes the recommendations of people[start:stop] from the matrices of recommendation_matrices, returns a
+    dictionary of person -> [(book, score), ...] sorted by score
+    '''
+    knows, bought, has = matrices
+    scores = knows[start:stop] @ bought
+    scores = scores - scores.multiply(has[start:stop])
+    scores.eliminate_zeros()
+    scores = scores.tocsr()
+
+    recommendations = {}
+    for i, person in enumerate(people[start:stop]):
+        row = scores.indptr[i], scores.indptr[i + 1]
+        recs = [(books[j], int(score)) for j, score in zip(scores.indices[row[0]:row[1]], scores.data[row[0]:row[1]])]
+        recs.sort(key=lambda rec: (-rec[1], rec[0].name))
+        recommendations[person] = recs
+    return recommendations
+
+# per-process state of the recommend_parallel workers
+_worker = {}
+
+def _start_worker(snapshot_path, person_category, book_category, owned_category):
+    '''
+    Memory-maps the snapshot once per worker process. Nothing is built up front: each chunk reads the relationships
+    and nodes it needs from the mapped arrays, so the workers share the page-cached snapshot instead of each holding
+    its own copy
+    '''
+    import numpy as np
+    from snapshot import SnapshotNodes
+    from snapshot import load_arrays
+    from snapshot import rel_categories
+
+    rel_table = rel_categories(snapshot_path)
+    nodes = SnapshotNodes(snapshot_path)
+
+    def rel_mask(category):
+        return None if category is None else np.array([c == category for c in rel_table], dtype=bool)
+
+    def code(category):
+        return nodes.categories.index(category) if category in nodes.categories else -1
+
+    _worker.update(nodes=nodes, arrays=load_arrays(snapshot_path), person=code(person_category),
+                   book=code(book_category), known=rel_mask("known"), bought=rel_mask("bought"),
+                   owned=rel_mask(owned_category))
+
+def _worker_edges(row_ids, rel_mask, category):
+    '''
+    The (row, target) arrays of the relationships of rel_mask from row_ids to nodes of the category code
+    '''
+    arrays = _worker["arrays"]
+    rows, targets = _row_edges(arrays["offsets"], arrays["targets"], arrays["rel_ids"], row_ids, rel_mask)
+    keep = _worker["nodes"].node_codes[targets] == category
+    return rows[keep], targets[keep]
+
+def _worker_rows(row_ids):
+    '''
+    Scores the people of the node ids row_ids. The columns of every matrix are node ids: knows is limited to the
+    friends of these people and bought to the rows of those friends
+    '''
+    import numpy as np
+
+    nodes = _worker["nodes"]
+    rows, friends = _worker_edges(row_ids, _worker["known"], _worker["person"])
+    friend_ids = np.unique(friends)
+    knows = _binary_matrix(rows, np.searchsorted(friend_ids, friends), (len(row_ids), len(friend_ids)))
+    bought = _binary_matrix(*_worker_edges(friend_ids, _worker["bought"], _worker["book"]),
+                            (len(friend_ids), len(nodes)))
+    has = _binary_matrix(*_worker_edges(row_ids, _worker["owned"], _worker["book"]), (len(row_ids), len(nodes)))
+
+    # every book bought by a friend, the only books that can be recommended
+    book_ids = np.unique(bought.indices)
+    books = dict(zip(book_ids.tolist(), nodes.nodes(book_ids)))
+    return score_rows((knows, bought, has), nodes.nodes(row_ids), books, 0, len(row_ids))
+
+def recommend_parallel(snapshot_path, workers=None, chunk_size=1000, person_category="Person", book_category="Book",
+                       owned_category=None):
+    '''
+    Computes recommend_all for a graph saved with PropertyGraph.save across a pool of worker processes. Every worker
+    memory-maps the same snapshot instead of receiving a pickled copy of the graph, and scores chunk_size people per
+    task, reading only the relationships of those people and of the people they know. At most two chunks per worker
+    are in flight at once. Yields the recommendations one chunk at a time, as dictionaries of
+    person -> [(book, score), ...], in the order the chunks finish
+    '''
+    import os
+    from concurrent.futures import FIRST_COMPLETED
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures import as_completed
+    from concurrent.futures import wait
+    from snapshot import SnapshotNodes
+
+    people = SnapshotNodes(snapshot_path).ids(person_category)
+    max_in_flight = 2 * (workers or os.cpu_count() or 1)
+
+    with ProcessPoolExecutor(workers, initializer=_start_worker,
+                             initargs=(snapshot_path, person_category, book_category, owned_category)) as pool:
+        pending = set()
+        for start in range(0, len(people), chunk_size):
+            pending.add(pool.submit(_worker_rows, people[start:start + chunk_size]))
+            if len(pending) < max_in_flight:
                 continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for chunk in done:
+                yield chunk.result()
+        for chunk in as_completed(pending):
+            yield chunk.result()
+
+class RecommendationCache:
+    '''
+    Keeps the book recommendations of every person up to date while relationships are added to and removed from the
+    graph, instead of rerunning recommend. A new "bought" relationship updates the person who bought the book and the
+    people who know them; a new "known" relationship updates the person who knows. A removed relationship recomputes
+    the same people from the graph. The graph keeps one rel relationship from each person
+    to each book recommended to them, removed once they buy the book.
+    Updates read the relationships the cache has been told about, never the graph's newer state, so that a batch of
+    relationships is counted once however the graph reports it
+    '''
+
+    def __init__(self, og_graph, rel=None):
+        self.og_graph = og_graph
+        self.rel = rel or Relationship("Recommendation")
+        self.owned = {}
+        self.knows = {}
+        # friend -> the people who know them, the reverse of knows
+        self.known_by = {}
+        self.scores = {}
+        for person in og_graph.get_nodes(category="Person"):
+            self.owned[person] = {book for book, _ in og_graph.adjacent(person, "Book", "bought")}
+            self.knows[person] = {friend for friend, _ in og_graph.adjacent(person, "Person", "known")}
+            for friend in self.knows[person]:
+                self.known_by.setdefault(friend, set()).add(person)
+        for person, recs in recommend_all(og_graph, owned_category="bought").items():
+            self.scores[person] = dict(recs)
+
+        # make the recommendation relationships in the graph match the scores
+        for person in self.scores:
+            linked = {book for book, _ in og_graph.adjacent(person, "Book", self.rel.category)}
+            for book in self.scores[person].keys() - linked:
+                og_graph.add_relationship(person, book, self.rel)
+            for book in linked - self.scores[person].keys():
+                self._unlink(person, book)
+        og_graph.subscribe(self)
+
+    def recommendations(self, person):
+        '''
+        Returns the current recommendations of a person as [(book, score), ...], best first
+        '''
+        recs = self.scores.get(person, {}).items()
+        return sorted(recs, key=lambda rec: (-rec[1], rec[0].name))
+
+    def close(self):
+        '''
+        Stops following the changes to the graph
+        '''
+        self.og_graph.unsubscribe(self)
+
+    def __call__(self, event, *args):
+        '''
+        PropertyGraph listener, see PropertyGraph.subscribe
+        '''
+        if event not in ("add_relationship", "remove_relationship"):
+            return
+        src, targ, rel = args
+        if src.category != "Person":
+            return
+        if rel.category == "bought" and targ.category == "Book":
+            if event == "add_relationship":
+                self._bought(src, targ)
+            else:
+                self._recompute(src)
+                for friend in list(self.known_by.get(src, ())):
+                    self._recompute(friend)
+        elif rel.category == "known" and targ.category == "Person":
+            if event == "add_relationship":
+                self._known(src, targ)
             else:
-                subgraph.add_relationship(og_person, book[0], rel = rel)
-                book_recs.append(book[0])
-        return subgraph, book_recs
+                self._recompute(src)
+
+    def _bought(self, person, book):
+        owned = self.owned.setdefault(person, set())
+        if book in owned:
+            return
+        owned.add(book)
+        if self.scores.get(person, {}).pop(book, None) is not None:
+            self._unlink(person, book)
+        for friend in self.known_by.get(person, ()):
+            self._add_score(friend, book)
+
+    def _known(self, person, friend):
+        knows = self.knows.setdefault(person, set())
+        if friend in knows:
+            return
+        knows.add(friend)
+        self.known_by.setdefault(friend, set()).add(person)
+        for book in self.owned.get(friend, ()):
+            self._add_score(person, book)
+
+    def _recompute(self, person):
+        '''
+        Rebuilds what the cache knows about one person from the graph, after one of their relationships was removed
+        '''
+        self.owned[person] = owned = {book for book, _ in self.og_graph.adjacent(person, "Book", "bought")}
+        knows = {friend for friend, _ in self.og_graph.adjacent(person, "Person", "known")}
+        for friend in self.knows.get(person, set()) - knows:
+            self.known_by[friend].discard(person)
+        for friend in knows:
+            self.known_by.setdefault(friend, set()).add(person)
+        self.knows[person] = knows
+        scores = {}
+        for friend in self.knows[person]:
+            for book in self.owned.get(friend, ()):
+                if book not in owned:
+                    scores[book] = scores.get(book, 0) + 1
+        old = self.scores.get(person, {})
+        for book in scores.keys() - old.keys():
+            self.og_graph.add_relationship(person, book, self.rel)
+        for book in old.keys() - scores.keys():
+            self._unlink(person, book)
+        self.scores[person] = scores
+
+    def _add_score(self, person, book):
+        if book in self.owned.get(person, ()):
+            return
+        scores = self.scores.setdefault(person, {})
+        if book not in scores:
+            scores[book] = 0
+            self.og_graph.add_relationship(person, book, self.rel)
+        scores[book] += 1
+
+    def _unlink(self, person, book):
+        for other, rel in self.og_graph.adjacent(person, "Book", self.rel.category):
+            if other == book:
+                self.og_graph.remove_relationship(person, other, rel)
 
 def add_recommendations_to_og(og_graph, source, book_recs, rel):
     '''
@@ -137,7 +518,7 @@ def main():
 
     # Printing out the first property graph
 
-    print(og_graph.propertyGraph)
+    og_graph.write(sys.stdout)
 
 
     recommendation_relationship = Relationship("Recommendation")
@@ -145,13 +526,13 @@ def main():
     subgraph_recommendation, book_recs = recommend(spencer, og_graph, recommendation_relationship)
 
     # Get Spencer's recommendations
-    print(subgraph_recommendation.propertyGraph)
+    subgraph_recommendation.write(sys.stdout)
 
 
     # add the recommendation relationships to the new graph
     new_propertygraph = add_recommendations_to_og(og_graph, spencer, book_recs, recommendation_relationship)
 
-    print(new_propertygraph.propertyGraph)
+    new_propertygraph.write(sys.stdout)
 
 
 
@@ -0,0 +1,97 @@
+"""
+File: rwlock.py
+Description: A reentrant reader-writer lock.  Any number of threads can
+hold the read lock at once; the write lock is exclusive.  Waiting writers
+are preferred over new readers so that a steady stream of reads can not
+starve them.
+
+A thread holding the write lock may take the read or write lock again, and
+a thread holding the read lock may take it again.  Upgrading a read lock to
+a write lock would deadlock as soon as two readers tried it, so it raises
+RuntimeError instead.
+
+"""
+
+import threading
+
+
+class _Side:
+    """ Context manager acquiring one side of an RWLock """
+
+    def __init__(self, acquire, release):
+        self.acquire = acquire
+        self.release = release
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class RWLock:
+
+    def __init__(self):
+        """ Class constructor """
+        self._cond = threading.Condition(threading.Lock())
+        # thread id -> number of read locks it holds
+        self._readers = {}
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self.read = _Side(self.acquire_read, self.release_read)
+        self.write = _Side(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        """ Block until the calling thread holds the read lock """
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            while self._writer is not None or self._waiting_writers:
+                self._cond.wait()
+            self._readers[me] = 1
+
+    def release_read(self):
+        """ Release one read lock of the calling thread """
+        me = threading.get_ident()
+        with self._cond:
+            depth = self._readers.get(me)
+            if depth is None:
+                raise RuntimeError("release_read() called without holding the read lock")
+            if depth > 1:
+                self._readers[me] = depth - 1
+                return
+            del self._readers[me]
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        """ Block until the calling thread holds the write lock """
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("can not upgrade a read lock to a write lock")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        """ Release one write lock of the calling thread """
+        with self._cond:
+            if self._writer != threading.get_ident():
+                raise RuntimeError("release_write() called without holding the write lock")
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._cond.notify_all()
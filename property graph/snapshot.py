@@ -0,0 +1,198 @@
+"""
+File: snapshot.py
+Description: Saves a PropertyGraph to a snapshot directory and loads it back.
+The relationships are stored as the CSR arrays of a CSRGraph in NumPy .npy
+files, which can be memory-mapped on load so that every process using the
+snapshot shares one page-cached copy.  The nodes are stored in .npy files
+too, so that a process can read single nodes without loading all of them
+(see SnapshotNodes): the category code of every node, and its name and
+properties as JSON values, one after the other and separated by commas.
+The relationship table is stored as JSON.
+
+    meta.json        format version, counts, indexed property keys, node categories
+                     in code order and the generation of the write-ahead log that
+                     continues it (see wal.py)
+    rels.json        categories and properties of the distinct relationships
+    *.npy            offsets, targets, rel_ids, in_offsets, in_sources, in_rel_ids,
+                     node_codes, names, name_offsets, props, prop_offsets
+
+Names, categories and property values must be JSON serializable.
+
+"""
+
+import json
+import os
+
+import numpy as np
+
+from csrgraph import CSRGraph
+from propertygraph import Node
+from propertygraph import Relationship
+
+FORMAT_VERSION = 2
+
+ARRAYS = ("offsets", "targets", "rel_ids", "in_offsets", "in_sources", "in_rel_ids")
+
+NODE_ARRAYS = ("node_codes", "names", "name_offsets", "props", "prop_offsets")
+
+
+def _write_json(path, name, data):
+    with open(os.path.join(path, name), "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def _read_json(path, name):
+    with open(os.path.join(path, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_values(path, name, offsets_name, values):
+    """ Save values as comma-separated JSON in name.npy, and the start of every
+    value in offsets_name.npy; value i ends one byte before value i + 1 starts """
+    parts = [json.dumps(value).encode() for value in values]
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    np.cumsum([len(part) + 1 for part in parts], out=offsets[1:])
+    np.save(os.path.join(path, name + ".npy"), np.frombuffer(b",".join(parts), dtype=np.uint8))
+    np.save(os.path.join(path, offsets_name + ".npy"), offsets)
+
+
+def save_snapshot(graph, path, log_generation=0):
+    """ Write graph to the directory path, creating it if needed.
+    log_generation is recorded for the write-ahead log, see wal.py """
+    compact = graph.propertyGraph if graph.frozen else CSRGraph.from_adjacency(graph.propertyGraph)
+    os.makedirs(path, exist_ok=True)
+
+    for name in ARRAYS:
+        np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(getattr(compact, name)))
+
+    np.save(os.path.join(path, "node_codes.npy"), compact.node_codes)
+    _save_values(path, "names", "name_offsets", (node.name for node in compact.nodes))
+    _save_values(path, "props", "prop_offsets", (node._props or None for node in compact.nodes))
+
+    _write_json(path, "rels.json", {
+        "categories": [rel.category for rel in compact.rels],
+        "props": [rel._props or None for rel in compact.rels],
+        "shared": [rel.is_shared() for rel in compact.rels],
+    })
+
+    # written last so that a directory with meta.json holds a complete snapshot
+    _write_json(path, "meta.json", {
+        "version": FORMAT_VERSION,
+        "nodes": len(compact.nodes),
+        "relationships": compact.num_edges(),
+        "indexed_keys": graph.indexed_keys(),
+        "node_categories": list(compact.node_categories),
+        "log_generation": log_generation,
+    })
+
+
+def read_meta(path):
+    """ Return the meta.json of the snapshot directory path, or None when
+    there is no complete snapshot there """
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return _read_json(path, "meta.json")
+
+
+class SnapshotNodes:
+    """ The nodes of a snapshot, read from its memory-mapped node arrays.
+    nodes(ids) makes the Node objects of some node ids only, so a process can
+    use a few nodes of a large snapshot without loading the others """
+
+    def __init__(self, path, mmap=True):
+        """ Class constructor """
+        meta = _read_json(path, "meta.json")
+        if meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"unsupported snapshot version {meta['version']} in {path}")
+        self.categories = meta["node_categories"]
+        for name in NODE_ARRAYS:
+            # plain arrays over the mapping: slicing np.memmap objects is slow
+            setattr(self, name, np.asarray(np.load(os.path.join(path, name + ".npy"),
+                                                   mmap_mode="r" if mmap else None)))
+
+    def __len__(self):
+        return len(self.node_codes)
+
+    def ids(self, category):
+        """ Return the array of the ids of the nodes of a category, in increasing order """
+        if category not in self.categories:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self.node_codes == self.categories.index(category))
+
+    def nodes(self, ids=None):
+        """ Return the Node objects, with their properties, of an array of node
+        ids, or of all the nodes in node id order if ids is None """
+        if ids is None:
+            ids = np.arange(len(self))
+            names = self._values(self.names)
+            props = self._values(self.props)
+        else:
+            ids = np.asarray(ids, dtype=np.int64)
+            names = self._values(self.names, self.name_offsets, ids)
+            props = self._values(self.props, self.prop_offsets, ids)
+        categories = self.categories
+        nodes = [Node(name, categories[code]) for name, code in zip(names, self.node_codes[ids].tolist())]
+        for node, node_props in zip(nodes, props):
+            if node_props:
+                node.props.update(node_props)
+        return nodes
+
+    @staticmethod
+    def _values(data, offsets=None, ids=None):
+        """ Decode the JSON values of ids in one go, all of them if ids is None """
+        if ids is None:
+            return json.loads(b"[" + data.tobytes() + b"]")
+        view = memoryview(data)
+        starts = offsets[ids].tolist()
+        ends = (offsets[ids + 1] - 1).tolist()
+        return json.loads(b"[" + b",".join([view[start:end] for start, end in zip(starts, ends)]) + b"]")
+
+
+def node_table(path):
+    """ Return the (names, categories) lists of the nodes of a snapshot, in node id order """
+    nodes = SnapshotNodes(path)
+    return nodes._values(nodes.names), [nodes.categories[code] for code in nodes.node_codes.tolist()]
+
+
+def rel_categories(path):
+    """ Return the categories of the distinct relationships of a snapshot, in rel id order """
+    return _read_json(path, "rels.json")["categories"]
+
+
+def load_arrays(path, mmap=True):
+    """ Return {name: array} of the CSR arrays of a snapshot, memory-mapped if mmap """
+    return {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r" if mmap else None)
+            for name in ARRAYS}
+
+
+def load_snapshot(path, mmap=True, graph_class=None):
+    """ Return the frozen PropertyGraph stored in the directory path """
+    if graph_class is None:
+        from propertygraph import PropertyGraph as graph_class
+
+    meta = _read_json(path, "meta.json")
+    if meta["version"] != FORMAT_VERSION:
+        raise ValueError(f"unsupported snapshot version {meta['version']} in {path}")
+
+    arrays = load_arrays(path, mmap)
+
+    nodes = SnapshotNodes(path, mmap).nodes()
+
+    table = _read_json(path, "rels.json")
+    rels = []
+    for category, props, shared in zip(table["categories"], table["props"], table["shared"]):
+        if shared:
+            rels.append(Relationship.shared(category))
+            continue
+        rel = Relationship(category)
+        for key, value in (props or {}).items():
+            rel[key] = value
+        rels.append(rel)
+
+    compact = CSRGraph(nodes, arrays["offsets"], arrays["targets"], arrays["rel_ids"], rels,
+                       incoming=(arrays["in_offsets"], arrays["in_sources"], arrays["in_rel_ids"]))
+    graph = graph_class(meta["indexed_keys"])
+    for node in nodes:
+        graph._index_node(node)
+    graph._use_compact(compact)
+    return graph
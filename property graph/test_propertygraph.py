@@ -3,11 +3,17 @@ Filenmae: test_propertygraphy.py
 A testfile using pytest for the propertygraph.py file that checks if the functions are working properly
 '''
 
+import json
+import os
+
 import pytest
 
 from propertygraph import Node
 from propertygraph import Relationship
 from propertygraph import PropertyGraph
+from graphio import load_csv
+from graphio import load_jsonl
+from wal import open_graph
 
 
 # Setting up the testing fixtures
@@ -149,12 +155,612 @@ def test_subgraph(pgraph, node_a, node_b, node_c):
     assert pgraph.subgraph([node_a]).propertyGraph == {node_a: []}, "Does not initiate Subgraph Dictionary Properly"
     assert pgraph.subgraph([node_a, node_b]).propertyGraph == {node_a: [], node_b: []}, "Does not Add multiple nodes to the Subgraph"
 
+def test_get_nodes_indexed(node_a, node_b, node_c, node_d, node_e):
+    # test that the property indexes stay up to date and agree with a full scan
+    pgraph = PropertyGraph(indexed_keys=["price"])
+    pgraph.add_node(node_b)
+    pgraph.add_node(node_c)
+    pgraph.add_node(node_e)
+    assert pgraph.indexed_keys() == ["price"], "Does not record the indexed keys"
+    assert pgraph.get_nodes(key = "price", value = 4) == {node_c}, "Does not find nodes through the property index"
 
+    node_c["price"] = 7
+    assert pgraph.get_nodes(key = "price", value = 4) == set(), "Does not remove stale values from the property index"
+    assert pgraph.get_nodes(key = "price", value = 7) == {node_c}, "Does not index updated property values"
 
+    node_b["price"] = 7
+    assert pgraph.get_nodes(category = "Drama", key = "price", value = 7) == {node_b}, "Does not intersect the index lookups"
+    assert pgraph.get_nodes(key = "sold", value = 2) == {node_e}, "Does not scan for keys without an index"
 
+    pgraph.create_index("sold")
+    assert pgraph.get_nodes(key = "sold", value = 2) == {node_e}, "Does not index existing nodes when an index is created"
 
+    pgraph.add_relationship(node_d, node_a, Relationship("Genre"))
+    assert pgraph.get_nodes(name = "Of Mice and Men") == {node_d, node_e}, "Does not index nodes added through relationships"
+    pgraph.add_node(node_d)
+    assert pgraph.adjacent(node_d) != set(), "Adding an existing node removes its relationships"
+    dracula = Node("Dracula", "Horror")
+    pgraph.add_node(dracula)
+    assert pgraph.get_nodes(name = "Dracula") == {dracula} and pgraph.estimate_nodes(name = "Dracula") == 1, \
+        "Does not index unique names"
+
+    other = PropertyGraph(indexed_keys=["price"])
+    other.add_node(node_c)
+    node_c["price"] = 9
+    assert pgraph.get_nodes(key = "price", value = 9) == other.get_nodes(key = "price", value = 9) == {node_c}, \
+        "Does not update the indexes of every graph holding the node"
+    assert pgraph.get_nodes(key = "price", value = 7) == {node_b} and other.estimate_nodes(key = "price", value = 7) == 0, \
+        "Leaves the old value in the index of a graph holding the node"
+
+def test_adjacent_direction(pgraph, node_a, node_d, node_e, rel_a, rel_b):
+    # test incoming and bidirectional adjacency
+    pgraph.add_relationship(node_a, node_e, rel_a)
+    pgraph.add_relationship(node_d, node_a, rel_b)
+
+    assert pgraph.adjacent(node_a, direction = "out") == {(node_e, rel_a)}, "Does not return outgoing relationships"
+    assert pgraph.adjacent(node_a, direction = "in") == {(node_d, rel_b)}, "Does not return incoming relationships"
+    assert pgraph.adjacent(node_a, direction = "both") == {(node_e, rel_a), (node_d, rel_b)}, "Does not return both directions"
+    assert pgraph.adjacent(node_e, rel_category = "Genre", direction = "in") == {(node_a, rel_a)}, "Does not filter incoming relationships"
+    assert pgraph.adjacent(node_e, rel_category = "Media", direction = "in") == set(), "Does not filter incoming relationships"
+    with pytest.raises(ValueError):
+        pgraph.adjacent(node_a, direction = "sideways")
+
+def test_adjacent_partitions(pgraph, node_a, node_b, node_d, rel_a, rel_b):
+    # test filtering adjacency by relationship and node category together and apart
+    pgraph.add_relationship(node_a, node_b, rel_a)
+    pgraph.add_relationship(node_a, node_d, rel_a)
+    pgraph.add_relationship(node_a, node_d, rel_b)
+    pgraph.add_relationship(node_a, node_a, rel_b)
 
+    assert pgraph.adjacent(node_a, rel_category = "Genre") == {(node_b, rel_a), (node_d, rel_a)}, "Does not filter by relationship category"
+    assert pgraph.adjacent(node_a, node_category = "Drama") == {(node_b, rel_a), (node_d, rel_a), (node_d, rel_b)}, "Does not filter by node category"
+    assert pgraph.adjacent(node_a, node_category = "Literary Fiction", rel_category = "Media") == {(node_a, rel_b)}, "Does not filter by both categories"
+    assert pgraph.adjacent(node_a, node_category = "Thriller", rel_category = "Media") == set(), "Returns relationships of the wrong node category"
+    assert pgraph.adjacent(node_d, rel_category = "Media", direction = "in") == {(node_a, rel_b)}, "Does not partition incoming relationships"
 
+def test_freeze_thaw(pgraph, node_a, node_b, node_d, rel_a, rel_b, rel_c):
+    # test that a frozen graph answers queries like the mutable one
+    pgraph.add_relationship(node_a, node_b, rel_a)
+    pgraph.add_relationship(node_a, node_d, rel_b)
+    pgraph.add_relationship(node_d, node_a, rel_c)
+    node_z = Node("Frankenstein", "Horror")
+    pgraph.add_node(node_z)
+    before = dict(pgraph.propertyGraph)
+
+    pgraph.freeze()
+    assert pgraph.frozen, "Does not mark the graph as frozen"
+    assert pgraph.propertyGraph == before, "Frozen graph does not hold the same relationships"
+    assert pgraph.adjacent(node_a) == {(node_b, rel_a), (node_d, rel_b)}, "Frozen adjacency does not match"
+    assert pgraph.adjacent(node_a, rel_category = "Media") == {(node_d, rel_b)}, "Frozen adjacency does not filter relationships"
+    assert pgraph.adjacent(node_a, node_category = "Drama", direction = "in") == {(node_d, rel_c)}, "Frozen adjacency does not return incoming relationships"
+    assert pgraph.adjacent(node_z, direction = "both") == set(), "Frozen adjacency adds relationships to isolated nodes"
+    assert pgraph.get_nodes(category = "Drama") == {node_b, node_d}, "Frozen graph does not find nodes"
+    with pytest.raises(RuntimeError):
+        pgraph.add_relationship(node_b, node_a, rel_a)
+
+    pgraph.thaw()
+    assert not pgraph.frozen, "Does not mark the graph as mutable"
+    assert pgraph.propertyGraph == before, "Thawed graph does not hold the same relationships"
+    pgraph.add_relationship(node_b, node_a, rel_a)
+    assert pgraph.adjacent(node_a, direction = "in") == {(node_d, rel_c), (node_b, rel_a)}, "Thawed graph does not accept new relationships"
+
+def test_pickle(node_c, rel_c, pgraph):
+    # test that nodes and relationships survive pickling, without the graphs holding them
+    import pickle
+    pgraph.add_node(node_c)
+    node = pickle.loads(pickle.dumps(node_c))
+    assert node == node_c and node.props == {"price": 4}, "Does not pickle nodes"
+    assert pickle.loads(pickle.dumps(rel_c))["Added"] == "Months Ago", "Does not pickle relationships"
+
+def test_slots_and_shared(node_a, node_c, rel_a):
+    # test the memory-lean layout of nodes and relationships
+    assert not hasattr(node_a, "__dict__"), "Nodes allocate an instance dictionary"
+    assert not hasattr(rel_a, "__dict__"), "Relationships allocate an instance dictionary"
+    assert node_a.category is Node("Emma", "Literary " + "Fiction").category, "Does not intern categories"
+    assert node_c.props == {"price": 4}, "Does not keep the properties given to the constructor"
+
+    shared = Relationship.shared("bought")
+    assert shared is Relationship.shared("bought"), "Does not share one relationship per category"
+    assert shared["Price"] == None, "Shared relationships carry properties"
+    with pytest.raises(TypeError):
+        shared["Price"] = 5
+    with pytest.raises(TypeError):
+        shared.props["Price"] = 5
+    assert shared._props == {} and Relationship("bought").props == {}, "Shared relationships carry properties"
+
+def test_remove_relationship(pgraph, node_a, node_d, rel_a, rel_b):
+    # test removing relationships keeps every adjacency structure in step
+    pgraph.add_relationship(node_a, node_d, rel_a)
+    pgraph.add_relationship(node_a, node_d, rel_b)
+    pgraph.remove_relationship(node_a, node_d, rel_a)
+    assert pgraph.propertyGraph[node_a] == [(node_d, rel_b)], "Does not remove the relationship"
+    assert pgraph.adjacent(node_a, rel_category = "Genre") == set(), "Does not remove the relationship from its partition"
+    assert pgraph.adjacent(node_d, direction = "in") == {(node_a, rel_b)}, "Does not remove the incoming relationship"
+    with pytest.raises(ValueError):
+        pgraph.remove_relationship(node_a, node_d, rel_a)
+
+def test_bulk_load(pgraph, node_a, node_b, node_d, rel_a, rel_b):
+    # test that bulk loading builds the same graph as adding relationships one by one
+    edges = [(node_a, node_b, rel_a), (node_a, node_d, rel_b), (node_d, node_a, rel_a), (node_a, node_b, rel_b)]
+    expected = PropertyGraph()
+    for src, targ, rel in edges:
+        expected.add_relationship(src, targ, rel)
+
+    node_z = Node("Frankenstein", "Horror")
+    pgraph.bulk_load([node_z], iter(edges), batch_size = 3)
+    assert pgraph.propertyGraph == {**expected.propertyGraph, node_z: []}, "Does not load the same relationships"
+    assert pgraph.adjacent(node_a, rel_category = "Media") == {(node_d, rel_b), (node_b, rel_b)}, "Does not partition bulk loaded relationships"
+    assert pgraph.adjacent(node_a, direction = "in") == {(node_d, rel_a)}, "Does not record incoming bulk loaded relationships"
+
+def test_load_csv_and_jsonl(tmp_path):
+    # test the streaming CSV and JSON-lines loaders
+    nodes_file = tmp_path / "nodes.csv"
+    nodes_file.write_text("name,category,Price\nCosmos,Book,17.0\nEmily,Person,\n")
+    edges_file = tmp_path / "edges.csv"
+    edges_file.write_text("src,src_category,rel,targ,targ_category,since\n"
+                          "Emily,Person,bought,Cosmos,Book,\n"
+                          "Emily,Person,known,Spencer,Person,2020\n")
+    graph = load_csv(PropertyGraph(indexed_keys=["Price"]), str(edges_file), str(nodes_file), batch_size = 1)
+    emily = Node("Emily", "Person")
+    assert graph.get_nodes(key = "Price", value = 17.0) == {Node("Cosmos", "Book")}, "Does not load node properties"
+    assert {(node.name, rel.category, rel["since"]) for node, rel in graph.adjacent(emily)} == \
+           {("Cosmos", "bought", None), ("Spencer", "known", 2020)}, "Does not load the relationships"
+    cosmos = next(iter(graph.get_nodes(name = "Cosmos")))
+    assert graph.propertyGraph[emily][0][0] is cosmos, "Does not reuse the loaded nodes in relationships"
+
+    jsonl_file = tmp_path / "graph.jsonl"
+    jsonl_file.write_text('{"type": "node", "name": "Cosmos", "category": "Book", "props": {"Price": 17.0}}\n'
+                          '{"type": "edge", "src": ["Emily", "Person"], "rel": "bought", "targ": ["Cosmos", "Book"]}\n')
+    graph = load_jsonl(PropertyGraph(), str(jsonl_file))
+    assert graph.adjacent(emily, node_category = "Book") == {(cosmos, Relationship.shared("bought"))}, "Does not load JSON-lines relationships"
+    assert graph.get_nodes(category = "Book").pop()["Price"] == 17.0, "Does not load JSON-lines node properties"
+
+def edge_summary(graph):
+    # the relationships of a graph as comparable values, Relationship objects have no equality
+    return {src: sorted((targ.name, targ.category, rel.category, sorted(rel.props.items()))
+                        for targ, rel in graph.propertyGraph[src])
+            for src in graph.propertyGraph}
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load(tmp_path, mmap, node_a, node_b, node_c, node_d, node_e, rel_a, rel_b, rel_c):
+    # test that a snapshot round trip keeps nodes, properties, relationships and indexes
+    pgraph = PropertyGraph(indexed_keys=["sold"])
+    pgraph.add_node(node_c)
+    pgraph.add_relationship(node_c, node_b, rel_a)
+    pgraph.add_relationship(node_c, node_e, rel_c)
+    pgraph.add_relationship(node_e, node_c, Relationship.shared("Genre"))
+    pgraph.add_node(Node("Frankenstein", "Horror"))
+    pgraph.save(str(tmp_path / "snapshot"))
+
+    loaded = PropertyGraph.load(str(tmp_path / "snapshot"), mmap = mmap)
+    assert loaded.frozen, "Loaded graph is not frozen"
+    assert edge_summary(loaded) == edge_summary(pgraph), "Does not keep the relationships"
+    assert loaded.get_nodes(key = "sold", value = 2) == {node_e}, "Does not keep the property indexes"
+    assert next(iter(loaded.get_nodes(name = "Little Women", category = "Literary Fiction")))["price"] == 4, "Does not keep node properties"
+    assert loaded.adjacent(node_a, direction = "in") == {(node_e, Relationship.shared("Genre"))}, "Does not keep shared relationships"
+    assert loaded.adjacent(node_d, rel_category = "Type", direction = "in") != set(), "Does not keep incoming relationships"
+
+    from snapshot import SnapshotNodes
+    nodes = SnapshotNodes(str(tmp_path / "snapshot"))
+    assert [(node.name, node._props) for node in nodes.nodes(nodes.ids("Drama"))] == \
+           [("Little Women", {}), ("Of Mice and Men", {"sold": 2})], \
+        "Does not read single nodes from the mapped arrays"
+    assert len(nodes.ids("Sci-Fi")) == 0, "Finds nodes of a missing category"
+
+    loaded.thaw()
+    loaded.add_relationship(node_b, node_d, rel_b)
+    assert loaded.adjacent(node_b) == {(node_d, rel_b)}, "Loaded graph can not be modified after thawing"
+
+def test_write_ahead_log(tmp_path, node_a, node_c, node_d, rel_a, rel_c):
+    # test that logged changes survive a restart and a compaction
+    snapshot_path = str(tmp_path / "snapshot")
+    log_path = str(tmp_path / "graph.log")
+
+    graph, log = open_graph(snapshot_path, log_path, batch_size = 2)
+    graph.add_relationship(node_c, node_d, rel_a)
+    graph.add_relationship(node_d, node_c, rel_c)
+    node_c["sold"] = 3
+    graph.add_relationship(node_c, node_c, rel_a)
+    graph.remove_relationship(node_c, node_c, rel_a)
+    log.close()
+
+    graph, log = open_graph(snapshot_path, log_path)
+    assert edge_summary(graph) == {node_c: [("Of Mice and Men", "Drama", "Genre", [])],
+                                   node_d: [("Little Women", "Literary Fiction", "Type", [("Added", "Months Ago")])]}, \
+        "Does not replay the logged relationships"
+    assert next(iter(graph.get_nodes(name = "Little Women")))._props == {"price": 4, "sold": 3}, "Does not replay node properties"
+
+    graph.add_relationship(node_a, node_a, rel_a)
+    graph.remove_relationship(node_a, node_a, rel_a)
+    log.compact()
+    graph.add_relationship(node_a, node_a, rel_a)
+    log.close()
+    with open(log_path) as f:
+        assert [json.loads(line)["type"] for line in f] == ["generation", "edge"], "Compaction does not empty the log"
+
+    graph, log = open_graph(snapshot_path, log_path)
+    assert graph.adjacent(node_a, rel_category = "Genre", node_category = "Literary Fiction") != set(), \
+        "Does not replay the log on top of the snapshot"
+    assert len(graph.propertyGraph[node_a]) == 2, "Replays relationships already in the snapshot"
+    log.close()
+
+    # automatic compaction triggered by a record must snapshot the change that record logs
+    snapshot_path = str(tmp_path / "auto")
+    log_path = str(tmp_path / "auto.log")
+    graph, log = open_graph(snapshot_path, log_path, batch_size = 1, compact_every = 2)
+    node = Node("Dracula", "Horror")
+    graph.add_node(node)
+    node["p"] = 5
+    log.close()
+    graph, log = open_graph(snapshot_path, log_path, batch_size = 1, compact_every = 2)
+    dracula = next(iter(graph.get_nodes(name = "Dracula")))
+    assert dracula._props == {"p": 5}, "Loses a property set as the log compacts"
+    graph.bulk_load(edges = [(dracula, node_c, rel_a), (dracula, node_d, rel_a), (dracula, dracula, rel_c)])
+    log.close()
+    graph, log = open_graph(snapshot_path, log_path)
+    dracula = next(iter(graph.get_nodes(name = "Dracula")))
+    assert len(graph.propertyGraph[dracula]) == 3, "Duplicates bulk loaded relationships as the log compacts"
+    log.close()
+
+
+def test_write_ahead_log_crash(tmp_path, monkeypatch, node_a, node_c, node_d, rel_a, rel_c):
+    # test that a crash at any point of compact() loses and duplicates nothing
+    import wal
+
+    class Crash(Exception):
+        pass
+
+    def crash_on(calls):
+        """ Return a function that raises Crash on the given call numbers and renames otherwise """
+        replace = os.replace
+        count = []
+
+        def fake(*args):
+            count.append(1)
+            if len(count) in calls:
+                raise Crash()
+            replace(*args)
+        return fake
+
+    for crash in ["before truncate", "between renames", "before first rename"]:
+        snapshot_path = str(tmp_path / crash / "snapshot")
+        log_path = str(tmp_path / crash / "graph.log")
+        os.makedirs(tmp_path / crash)
+        graph, log = open_graph(snapshot_path, log_path)
+        graph.add_relationship(node_c, node_d, rel_a)
+        log.compact()
+        graph.add_relationship(node_d, node_c, rel_c)
+        log.commit()
+
+        if crash == "before truncate":
+            monkeypatch.setattr(log, "_start", lambda generation: (_ for _ in ()).throw(Crash()))
+        else:
+            monkeypatch.setattr(wal.os, "replace", crash_on({2} if crash == "between renames" else {1}))
+        with pytest.raises(Crash):
+            log.compact()
+        monkeypatch.undo()
+        log._file.close()
+
+        graph, log = open_graph(snapshot_path, log_path)
+        assert edge_summary(graph) == {node_c: [("Of Mice and Men", "Drama", "Genre", [])],
+                                       node_d: [("Little Women", "Literary Fiction", "Type", [("Added", "Months Ago")])]}, \
+            f"Does not recover from a crash {crash}"
+        assert not os.path.exists(snapshot_path + ".tmp") and not os.path.exists(snapshot_path + ".old"), \
+            f"Leaves the swap directories behind after a crash {crash}"
+        graph.add_relationship(node_a, node_a, rel_a)
+        log.close()
+        graph, log = open_graph(snapshot_path, log_path)
+        assert graph.num_relationships() == 3, f"Does not keep logging after a crash {crash}"
+        log.close()
+
+def test_traverse(pgraph, node_a, node_b, node_d, rel_a, rel_b):
+    # test multi-hop traversal with and without a pattern
+    node_y = Node("Dracula", "Horror")
+    node_z = Node("Frankenstein", "Horror")
+    pgraph.add_relationship(node_a, node_b, rel_a)
+    pgraph.add_relationship(node_a, node_d, rel_a)
+    pgraph.add_relationship(node_b, node_y, rel_b)
+    pgraph.add_relationship(node_d, node_y, rel_b)
+    pgraph.add_relationship(node_d, node_z, rel_b)
+    pgraph.add_relationship(node_y, node_a, rel_a)
+
+    paths = list(pgraph.traverse(node_a, pattern = [("Genre", "Drama"), ("Media", "Horror")]))
+    assert {path[-1] for path in paths} == {node_y, node_z}, "Does not follow the pattern"
+    assert len(paths) == 2, "Yields a node reached through several paths more than once"
+    assert all(len(path) == 5 for path in paths), "Does not yield complete paths"
+
+    reached = [path[-1] for path in pgraph.traverse(node_a)]
+    assert sorted(node.name for node in reached) == ["Dracula", "Frankenstein", "Little Women", "Of Mice and Men"], \
+        "Does not reach every node once"
+    assert [len(path) for path in pgraph.traverse(node_a)] == [3, 3, 5, 5], "Breadth first traversal is not in hop order"
+    assert {path[-1] for path in pgraph.traverse(node_a, max_depth = 1, order = "dfs")} == {node_b, node_d}, "Does not stop at max_depth"
+    assert len(list(pgraph.traverse(node_a, limit = 3))) == 3, "Does not stop at the limit"
+    assert {path[-1] for path in pgraph.traverse(node_y, pattern = [("Media", None)], direction = "in")} == {node_b, node_d}, \
+        "Does not traverse incoming relationships"
+
+    pgraph.freeze()
+    assert {path[-1] for path in pgraph.traverse(node_a, pattern = [("Genre", "Drama"), ("Media", "Horror")])} == {node_y, node_z}, \
+        "Does not traverse frozen graphs"
 
-
-
+@pytest.fixture
+def bookstore():
+    # a small version of the recommend.py graph
+    graph = PropertyGraph(indexed_keys=["Price"])
+    emily, spencer, brendan = Node("Emily", "Person"), Node("Spencer", "Person"), Node("Brendan", "Person")
+    cosmos = Node("Cosmos", "Book", ("Price", 17.0))
+    database_design = Node("Database Design", "Book", ("Price", 195.0))
+    dna = Node("DNA and You", "Book", ("Price", 11.5))
+    known, bought = Relationship("known"), Relationship("bought")
+    for src, targ, rel in [(emily, spencer, known), (spencer, emily, known), (spencer, brendan, known),
+                           (emily, database_design, bought), (spencer, cosmos, bought),
+                           (spencer, database_design, bought), (brendan, dna, bought),
+                           (brendan, database_design, bought)]:
+        graph.add_relationship(src, targ, rel)
+    return graph
+
+def test_query(bookstore):
+    # test the pattern query language and its planner
+    rows = list(bookstore.query("MATCH (x:Person {name: 'Spencer'})<-[:known]-(p:Person)-[:bought]->(b:Book) "
+                                "WHERE b.Price > 100 RETURN p, b"))
+    assert [(row["p"].name, row["b"].name) for row in rows] == [("Emily", "Database Design")], "Does not match the pattern"
+
+    rows = bookstore.query("(p:Person)-[r:bought]->(b:Book {name: 'DNA and You'})")
+    assert [(row["p"].name, row["r"].category) for row in rows] == [("Brendan", "bought")], "Does not match inline properties"
+    assert sorted(row["p"].name for row in bookstore.query("(p:Person)-[:known]-(:Person {name: 'Emily'})")) == \
+           ["Spencer", "Spencer"], "Does not match relationships in either direction"
+    assert list(bookstore.query("(p:Person)-[:bought]->(b:Book) WHERE b.Price = 1.0")) == [], "Returns matches failing the condition"
+
+    from query import Query
+    query = Query("(p:Person)-[:bought]->(b:Book) WHERE b.Price = 11.5 AND p.name <> 'Emily'")
+    assert query.plan(bookstore) == (1, [3, 1]), "Does not start from the most selective node pattern"
+    assert query.explain(bookstore)[0] == "start at (b:Book), ~1 candidate nodes", "Does not explain the plan"
+    assert [row["p"].name for row in query.run(bookstore)] == ["Brendan"], "Does not run the planned query"
+    with pytest.raises(ValueError):
+        Query("(p:Person)-[:bought]->(b:Book) RETURN c")
+    with pytest.raises(ValueError):
+        Query("(p:Person)-[:bought]->")
+
+def test_query_cache(node_a, node_b, node_c, node_d, rel_a, rel_b):
+    # test that cached results are reused and invalidated when the nodes they depend on change
+    pgraph = PropertyGraph(cache_size = 2)
+    pgraph.add_relationship(node_a, node_b, rel_a)
+    pgraph.add_relationship(node_d, node_b, rel_a)
+
+    assert pgraph.adjacent(node_a) == {(node_b, rel_a)}, "Cached adjacency is wrong"
+    assert pgraph.adjacent(node_a) == {(node_b, rel_a)}, "Cached adjacency is wrong"
+    assert pgraph.cache_stats()["hits"] == 1 and pgraph.cache_stats()["misses"] == 1, "Does not reuse cached results"
+
+    pgraph.adjacent(node_d)
+    pgraph.add_relationship(node_a, node_d, rel_b)
+    assert pgraph.adjacent(node_a) == {(node_b, rel_a), (node_d, rel_b)}, "Does not invalidate the changed node"
+    assert pgraph.adjacent(node_d, direction = "in") == {(node_a, rel_b)}, "Does not invalidate the target node"
+
+    pgraph.adjacent(node_b, direction = "in")
+    assert pgraph.cache_stats()["evictions"] > 0 and pgraph.cache_stats()["size"] == 2, "Does not bound the cache"
+
+    assert pgraph.get_nodes(key = "price", value = 4) == set(), "Cached get_nodes is wrong"
+    node_a["price"] = 4
+    assert pgraph.get_nodes(key = "price", value = 4) == {node_c}, "Does not invalidate get_nodes on property changes"
+    pgraph.add_node(Node("Little Women", "Poetry"))
+    assert len(pgraph.get_nodes(name = "Little Women")) == 3, "Does not invalidate get_nodes on new nodes"
+
+def test_query_cache_policies():
+    # test the eviction policies and expiry of the cache itself
+    from querycache import QueryCache
+    now = [0.0]
+    cache = QueryCache(2, "lru", ttl = 10, clock = lambda: now[0])
+    cache.put("a", 0, 1)
+    cache.put("b", 0, 2)
+    cache.get("a", 0)
+    cache.put("c", 0, 3)
+    assert cache.get("b", 0) is None and cache.get("a", 0) == 1, "LRU does not evict the least recently used result"
+    assert cache.get("a", 1) is None, "Returns results of another version"
+    now[0] = 11.0
+    assert cache.get("c", 0) is None, "Returns expired results"
+
+    cache = QueryCache(2, "fifo")
+    cache.put("a", 0, 1)
+    cache.put("b", 0, 2)
+    cache.get("a", 0)
+    cache.put("c", 0, 3)
+    assert cache.get("a", 0) is None and cache.get("b", 0) == 2, "FIFO does not evict the oldest result"
+
+def test_induced_subgraph(pgraph, node_a, node_b, node_d, rel_a, rel_b):
+    # test that subgraphs keep the relationships between their nodes, copied or as a view
+    node_z = Node("Frankenstein", "Horror")
+    pgraph.add_relationship(node_a, node_b, rel_a)
+    pgraph.add_relationship(node_b, node_a, rel_b)
+    pgraph.add_relationship(node_a, node_d, rel_a)
+    pgraph.add_relationship(node_z, node_a, rel_a)
+
+    subgraph = pgraph.subgraph([node_a, node_b, node_z])
+    assert subgraph.propertyGraph == {node_a: [(node_b, rel_a)], node_b: [(node_a, rel_b)], node_z: [(node_a, rel_a)]}, \
+        "Does not copy the interconnecting relationships"
+    assert subgraph.adjacent(node_a, direction = "in") == {(node_b, rel_b), (node_z, rel_a)}, "Does not index the copied relationships"
+
+    view = pgraph.subgraph_view([node_a, node_b, node_z])
+    assert dict(view.propertyGraph) == subgraph.propertyGraph, "View does not hold the same relationships"
+    assert view.adjacent(node_a, direction = "both") == {(node_b, rel_a), (node_b, rel_b), (node_z, rel_a)}, "View adjacency is wrong"
+    assert view.get_nodes(category = "Drama") == {node_b}, "View returns nodes outside of it"
+    assert [path[-1] for path in view.traverse(node_z)] == [node_a, node_b], "View does not traverse inside the view"
+
+    pgraph.add_relationship(node_z, node_b, rel_b)
+    assert view.adjacent(node_z) == {(node_a, rel_a), (node_b, rel_b)}, "View does not show changes to the graph"
+    assert view.materialize().propertyGraph[node_z] == [(node_a, rel_a), (node_b, rel_b)], "Does not materialize the view"
+
+def test_analytics(pgraph, node_a, node_b, node_d, rel_a, rel_b):
+    # test degree histograms, connected components and PageRank
+    from analytics import connected_components, degree_histogram, pagerank
+    node_y = Node("Dracula", "Horror")
+    node_z = Node("Frankenstein", "Horror")
+    pgraph.add_relationship(node_a, node_b, rel_a)
+    pgraph.add_relationship(node_a, node_d, rel_a)
+    pgraph.add_relationship(node_b, node_a, rel_b)
+    pgraph.add_relationship(node_y, node_z, rel_b)
+
+    assert degree_histogram(pgraph) == {"Genre": {0: 4, 2: 1}, "Media": {0: 3, 1: 2}}, "Out degree histogram is wrong"
+    assert degree_histogram(pgraph, "in", node_category = "Drama") == {"Genre": {1: 2}, "Media": {0: 2}}, \
+        "In degree histogram is wrong"
+
+    assert connected_components(pgraph) == [{node_a, node_b, node_d}, {node_y, node_z}], "Components are wrong"
+    assert len(connected_components(pgraph, rel_categories = "Genre")) == 3, "Does not filter relationships"
+
+    scores = pagerank(pgraph)
+    assert abs(sum(scores.values()) - 1) < 1e-9, "PageRank does not sum to 1"
+    assert scores[node_a] > scores[node_y], "PageRank does not favour linked nodes"
+    personal = pagerank(pgraph, personalization = node_y)
+    assert personal[node_a] == 0 and personal[node_z] > 0, "Personalized PageRank leaves the personalized nodes"
+
+    pgraph.freeze()
+    assert pagerank(pgraph) == scores, "Frozen graphs give different results"
+
+def test_streaming_output(pgraph, node_a, node_c, node_d, rel_a, rel_c):
+    # test the streaming exporters and the short repr
+    import io
+    import xml.etree.ElementTree as ElementTree
+    pgraph.add_relationship(node_c, node_d, rel_c)
+    pgraph.add_relationship(node_d, node_a, rel_a)
+    pgraph.add_node(Node("Frankenstein", "Horror"))
+    pgraph.add_node(Node("Dracula", "Horror"))
+
+    assert repr(pgraph) == "PropertyGraph(4 nodes, 2 relationships: Node(Little Women:Literary Fiction     {'price': 4}), " \
+                           "Node(Of Mice and Men:Drama), Node(Frankenstein:Horror), ...)", "Does not show a short summary"
+    assert list(pgraph.iter_lines())[:3] == ["Node(Little Women:Literary Fiction)",
+                                             "    Relationship(Type) Node(Of Mice and Men:Drama)",
+                                             "Node(Of Mice and Men:Drama)"], "Does not stream the graph as text"
+
+    out = io.StringIO()
+    pgraph.write(out, "jsonl", chunk_size = 2)
+    out.seek(0)
+    reloaded = load_jsonl(PropertyGraph(), out)
+    assert not out.closed, "Closes a file object it did not open"
+    assert edge_summary(reloaded) == edge_summary(pgraph), "JSON-lines output can not be loaded back"
+    assert reloaded.get_nodes(name = "Little Women").pop()["price"] == 4, "JSON-lines output loses node properties"
+
+    out = io.StringIO()
+    pgraph.write(out, "graphml")
+    root = ElementTree.fromstring(out.getvalue())
+    ns = {"g": "http://graphml.graphdrawing.org/xmlns"}
+    assert len(root.findall("g:graph/g:node", ns)) == 4, "GraphML output does not hold the nodes"
+    assert len(root.findall("g:graph/g:edge", ns)) == 2, "GraphML output does not hold the relationships"
+    types = {key.get("attr.name"): key.get("attr.type") for key in root.findall("g:key", ns)}
+    assert types["price"] == "long", "Does not type integer properties"
+
+    mixed = PropertyGraph()
+    for name, props in [("a", {"w": 1, "flag": True, "note": 2}), ("b", {"w": 2.5, "flag": 1, "note": "x"})]:
+        node = Node(name, "Thing")
+        for key, value in props.items():
+            node[key] = value
+        mixed.add_node(node)
+    out = io.StringIO()
+    mixed.write(out, "graphml")
+    types = {key.get("attr.name"): key.get("attr.type")
+             for key in ElementTree.fromstring(out.getvalue()).findall("g:key", ns)}
+    assert types == {"name": "string", "category": "string", "w": "double", "flag": "string", "note": "string"}, \
+        "Does not widen the types of mixed properties"
+    with pytest.raises(ValueError):
+        pgraph.write(out, "csv")
+
+
+def test_benchmark_smoke():
+    from benchmark import run_benchmark, run_isolated, synthetic_graph
+
+    people, books, edges = synthetic_graph(500)
+    edges = list(edges)
+    assert len(edges) == 500, "Does not generate the requested number of relationships"
+    assert {rel.category for _, _, rel in edges} == {"known", "bought"}, "Does not mix known and bought"
+    counts = {}
+    for src, _, _ in edges:
+        counts[src] = counts.get(src, 0) + 1
+    assert max(counts.values()) > 5 * len(edges) / len(people), "Out-degrees are not heavy tailed"
+
+    results = run_benchmark(500, num_queries = 5)
+    assert results["edges"] == 500 and results["bulk_load_edges_per_s"] > 0, "Does not report ingest throughput"
+    assert set(results["frozen_adjacent_known"]) == {"p50_us", "p90_us", "p99_us", "max_us"}, \
+        "Does not report latency percentiles"
+    assert run_isolated(500, num_queries = 5)["edges"] == 500, "Does not run a size in its own process"
+
+
+def test_thread_safe_stress():
+    import sys
+    import threading
+    from rwlock import RWLock
+
+    lock = RWLock()
+    with lock.write:
+        with lock.read:
+            pass
+    with lock.read:
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+
+    graph = PropertyGraph(cache_size = 64, thread_safe = True)
+    people = [Node(f"person {i}", "Person") for i in range(20)]
+    bought = Relationship.shared("bought")
+    for person in people:
+        graph.add_node(person)
+    errors = []
+    done = threading.Event()
+
+    def writer(offset):
+        try:
+            for i in range(300):
+                book = Node(f"book {offset} {i}", "Book")
+                graph.add_relationship(people[i % len(people)], book, bought)
+                if i % 3 == 0:
+                    graph.remove_relationship(people[i % len(people)], book, bought)
+                if i % 50 == 0:
+                    graph.bulk_load(edges = [(people[0], Node(f"bulk {offset} {i}", "Book"), bought)])
+        except Exception as error:
+            errors.append(error)
+
+    def reader():
+        try:
+            while not done.is_set():
+                for person in people:
+                    with graph.read_lock():
+                        for book, rel in graph.adjacent(person, rel_category = "bought"):
+                            assert (person, rel) in graph.adjacent(book, direction = "in")
+                    list(graph.traverse(person, max_depth = 2, direction = "both"))
+                graph.get_nodes(category = "Book")
+                repr(graph)
+                with graph.read_lock():
+                    list(graph.iter_lines())
+        except Exception as error:
+            errors.append(error)
+
+    # switch threads as often as possible to provoke races
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        readers = [threading.Thread(target = reader) for _ in range(4)]
+        writers = [threading.Thread(target = writer, args = (n,)) for n in range(2)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert not errors, f"Concurrent access failed: {errors[0]!r}" if errors else ""
+    assert graph.num_relationships() == 2 * 200 + 2 * 6, "Lost or duplicated relationships under concurrency"
+    assert len(graph.get_nodes(category = "Book")) == 2 * 300 + 2 * 6, "Lost nodes under concurrency"
+
+    # a reader that runs as soon as a property write releases the lock must see the new value
+    graph = PropertyGraph(cache_size = 64, thread_safe = True)
+    node = Node("Dracula", "Horror")
+    graph.add_node(node)
+    release_write = graph._lock.write.release
+
+    def release_then_read():
+        release_write()
+        if graph._lock._writer is None:
+            graph.get_nodes(key = "rating", value = 5)
+
+    graph._lock.write.release = release_then_read
+    node["rating"] = 5
+    graph._lock.write.release = release_write
+    assert graph.get_nodes(key = "rating", value = 5) == {node}, "Caches queries of a half-set property"
@@ -0,0 +1,172 @@
+'''
+Filename: test_recommend.py
+A testfile using pytest for the recommend.py file that checks the recommendations agree with each other
+'''
+
+import pytest
+
+from propertygraph import Node
+from propertygraph import Relationship
+from propertygraph import PropertyGraph
+from recommend import RecommendationCache
+from recommend import recommend
+from recommend import recommend_all
+from recommend import recommend_pagerank
+from recommend import recommend_parallel
+from recommend import recommend_top_k
+
+
+# Setting up the testing fixtures
+
+@pytest.fixture
+def og_graph():
+    # the graph built by recommend.py, plus Trevor knowing Emily and Brendan and Emily buying DNA and You
+    emily, spencer, brendan = Node("Emily", "Person"), Node("Spencer", "Person"), Node("Brendan", "Person")
+    trevor, paxtyn = Node("Trevor", "Person"), Node("Paxtyn", "Person")
+    cosmos = Node("Cosmos", "Book", ("Price", 17.00))
+    database_design = Node("Database Design", "Book", ("Price", 195.00))
+    the_life_of_cronkite = Node("The Life of Cronkite", "Book", ("Price", 29.95))
+    dna = Node("DNA and You", "Book", ("Price", 11.50))
+    known = Relationship("known")
+    bought = Relationship("bought")
+
+    graph = PropertyGraph()
+    for src, targ, rel in [(emily, spencer, known), (spencer, emily, known), (spencer, brendan, known),
+                           (trevor, emily, known), (trevor, brendan, known),
+                           (emily, database_design, bought), (emily, dna, bought), (spencer, cosmos, bought),
+                           (spencer, database_design, bought), (brendan, dna, bought),
+                           (trevor, cosmos, bought), (trevor, database_design, bought),
+                           (paxtyn, database_design, bought), (paxtyn, the_life_of_cronkite, bought),
+                           (brendan, database_design, bought)]:
+        graph.add_relationship(src, targ, rel)
+    return graph
+
+def person(graph, name):
+    return next(iter(graph.get_nodes(name=name, category="Person")))
+
+# Setting up the Python tests
+
+def test_recommend(og_graph):
+    # test the single person recommendations
+    subgraph, book_recs = recommend(person(og_graph, "Spencer"), og_graph, Relationship("Recommendation"))
+    assert [book.name for book in book_recs] == ["DNA and You"], "Does not recommend the books friends bought"
+    assert subgraph.adjacent(person(og_graph, "Spencer"), rel_category="Recommendation") != set(), \
+        "Does not add the recommendations to the subgraph"
+
+@pytest.mark.parametrize("frozen", [False, True])
+def test_recommend_all(og_graph, frozen):
+    # test that the batch recommendations agree with recommend and count the friends
+    expected = {p: set(recommend(p, og_graph, Relationship("Recommendation"))[1])
+                for p in og_graph.get_nodes(category="Person")}
+    if frozen:
+        og_graph.freeze()
+    recommendations = recommend_all(og_graph)
+
+    assert {p: {book for book, _ in recs} for p, recs in recommendations.items()} == expected, \
+        "Does not agree with recommend"
+    assert [(book.name, score) for book, score in recommendations[person(og_graph, "Trevor")]] == [("DNA and You", 2)], \
+        "Does not score the recommendations"
+
+def test_recommend_top_k(og_graph):
+    # test the scored, bounded recommendations over several hops
+    trevor = person(og_graph, "Trevor")
+    assert recommend_top_k(trevor, og_graph, k=5, hops=1) == \
+           [(b, s) for b, s in recommend_all(og_graph)[trevor]], "Does not agree with recommend_all for one hop"
+
+    # Paxtyn -> Trevor, who bought Cosmos, -> Emily and Brendan, who both bought DNA and You
+    paxtyn = person(og_graph, "Paxtyn")
+    og_graph.add_relationship(paxtyn, trevor, Relationship("known"))
+    recs = recommend_top_k(paxtyn, og_graph, k=2, hops=2, decay=0.25)
+    assert [(book.name, score) for book, score in recs] == [("Cosmos", 1.0), ("DNA and You", 0.5)], \
+        "Does not weight the second hop"
+    assert len(recommend_top_k(paxtyn, og_graph, k=1, hops=2)) == 1, "Does not keep only the top k"
+
+    recs = recommend_top_k(paxtyn, og_graph, k=1, hops=2, weight_key="Price")
+    assert [(book.name, score) for book, score in recs] == [("Cosmos", 17.0)], "Does not weight by the book property"
+
+    cosmos = recs[0][0]
+    buyer = next(other for other, _ in og_graph.adjacent(cosmos, "Person", "bought", direction="in"))
+    og_graph.add_relationship(buyer, cosmos, Relationship("bought"))
+    recs = recommend_top_k(paxtyn, og_graph, k=1, hops=2, weight_key="Price")
+    assert [(book.name, score) for book, score in recs] == [("Cosmos", 17.0)], "Counts a friend who bought a book twice twice"
+
+def test_recommendation_cache(og_graph):
+    # test that the cached recommendations follow new relationships and match a full recompute
+    cache = RecommendationCache(og_graph)
+    spencer, emily, paxtyn = person(og_graph, "Spencer"), person(og_graph, "Emily"), person(og_graph, "Paxtyn")
+    dna = next(iter(og_graph.get_nodes(name="DNA and You")))
+    cronkite = next(iter(og_graph.get_nodes(name="The Life of Cronkite")))
+
+    def check():
+        expected = recommend_all(og_graph, owned_category="bought")
+        for p in og_graph.get_nodes(category="Person"):
+            assert cache.recommendations(p) == expected[p], "Cached recommendations differ from a recompute"
+            linked = {book for book, _ in og_graph.adjacent(p, "Book", "Recommendation")}
+            assert linked == {book for book, _ in expected[p]}, "Recommendation relationships are out of date"
+
+    check()
+    og_graph.add_relationship(spencer, paxtyn, Relationship("known"))
+    check()
+    assert (cronkite, 1) in cache.recommendations(spencer), "Does not follow new known relationships"
+
+    og_graph.add_relationship(spencer, dna, Relationship("bought"))
+    check()
+    assert dna not in dict(cache.recommendations(spencer)), "Recommends books the person bought"
+
+    og_graph.add_relationship(emily, cronkite, Relationship("bought"))
+    og_graph.add_relationship(emily, cronkite, Relationship("bought"))
+    check()
+    assert (cronkite, 2) in cache.recommendations(spencer), "Does not follow new bought relationships"
+
+    for book, rel in list(og_graph.adjacent(emily, "Book", "bought")):
+        og_graph.remove_relationship(emily, book, rel)
+    check()
+    assert (cronkite, 1) in cache.recommendations(spencer), "Does not follow removed bought relationships"
+
+    og_graph.remove_relationship(spencer, dna, next(rel for book, rel in og_graph.adjacent(spencer, "Book", "bought")
+                                                    if book == dna))
+    check()
+    for friend, rel in list(og_graph.adjacent(spencer, "Person", "known")):
+        og_graph.remove_relationship(spencer, friend, rel)
+    check()
+    assert cache.recommendations(spencer) == [], "Does not follow removed known relationships"
+
+    ann, bob, book = Node("Ann", "Person"), Node("Bob", "Person"), Node("Xenogenesis", "Book")
+    og_graph.bulk_load(edges=[(bob, book, Relationship("bought")), (ann, bob, Relationship("known"))])
+    check()
+    assert cache.recommendations(ann) == [(book, 1)], "Counts a bulk loaded relationship twice"
+
+    cache.close()
+    og_graph.add_relationship(paxtyn, spencer, Relationship("known"))
+    assert cache.recommendations(paxtyn) == [], "Follows changes after being closed"
+
+def test_recommend_parallel(og_graph, tmp_path):
+    # test that the process pool computes the same recommendations as recommend_all, in chunks
+    og_graph.save(str(tmp_path / "snapshot"))
+    chunks = list(recommend_parallel(str(tmp_path / "snapshot"), workers=2, chunk_size=2))
+    assert len(chunks) == 3, "Does not split the people into chunks"
+
+    recommendations = {}
+    for chunk in chunks:
+        recommendations.update(chunk)
+    expected = recommend_all(og_graph)
+    assert {p: [(b.name, s) for b, s in recs] for p, recs in recommendations.items()} == \
+           {p: [(b.name, s) for b, s in recs] for p, recs in expected.items()}, "Does not agree with recommend_all"
+    books = {b.name: b for recs in expected.values() for b, _ in recs}
+    assert all(b.props == books[b.name].props for recs in recommendations.values() for b, _ in recs), \
+        "Does not load the book properties"
+
+    # more chunks than may be in flight at once
+    recommendations = {}
+    for chunk in recommend_parallel(str(tmp_path / "snapshot"), workers=1, chunk_size=1, owned_category="bought"):
+        recommendations.update(chunk)
+    expected = recommend_all(og_graph, owned_category="bought")
+    assert {p: [(b.name, s) for b, s in recs] for p, recs in recommendations.items()} == \
+           {p: [(b.name, s) for b, s in recs] for p, recs in expected.items()}, "Does not agree with recommend_all"
+
+def test_recommend_pagerank(og_graph):
+    # test the personalized PageRank candidates
+    spencer = person(og_graph, "Spencer")
+    recs = recommend_pagerank(spencer, og_graph, k=5)
+    assert [book.name for book, _ in recs] == ["DNA and You"], "Does not rank the books reachable from the person"
+    assert recommend_pagerank(person(og_graph, "Paxtyn"), og_graph) == [], "Recommends books outside the person's reach"
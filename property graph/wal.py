@@ -0,0 +1,237 @@
+"""
+File: wal.py
+Description: An append-only write-ahead log for a PropertyGraph.
+Once attached, every node, relationship and node property added to the graph,
+and every relationship removed from it, is appended to the log as a JSON-lines
+record (the graphio.py format, plus "prop" and "remove_edge" records).
+Records are buffered and written in groups (group commit).  On startup the
+log is replayed on top of the latest snapshot, and compact() folds the log
+into a new snapshot and empties it.
+
+Compaction is crash-safe.  Every log starts with a generation record, and
+compact() writes the next generation into the meta.json of the snapshot.
+So a log that the snapshot already holds is recognised and skipped when
+the crash came before the log was emptied.  The new snapshot is written to
+"<snapshot>.tmp" and swapped in through "<snapshot>.old".  open_graph
+finishes or undoes an interrupted swap.
+
+Properties set on Relationship objects after they were added are not logged.
+
+"""
+
+import json
+import os
+import shutil
+
+from snapshot import read_meta
+from snapshot import save_snapshot
+
+from graphio import NodeTable
+from graphio import edge_record
+from graphio import node_record
+from graphio import relationship
+
+
+class WriteAheadLog:
+
+    def __init__(self, path, snapshot_path=None, batch_size=100, compact_every=None, fsync=False, generation=0):
+        """ Class constructor.
+        path - the log file, appended to
+        snapshot_path - snapshot directory used by compact()
+        batch_size - number of records buffered before they are written
+        compact_every - compact automatically once this many records were logged
+        fsync - force every group commit to disk, not just to the OS
+        generation - generation of a new log; an existing log keeps its own """
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.batch_size = batch_size
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.graph = None
+        self._buffer = []
+        self._logged = 0
+        self._file = open(path, "a", encoding="utf-8")
+        existing = log_generation(path)
+        if existing is None:
+            self._start(generation)
+        else:
+            self.generation = existing
+
+    def attach(self, graph):
+        """ Start logging the changes made to graph """
+        self.graph = graph
+        graph.subscribe(self)
+
+    def detach(self):
+        """ Stop logging, writing the records still buffered """
+        self.commit()
+        if self.graph is not None:
+            self.graph.unsubscribe(self)
+            self.graph = None
+
+    def __call__(self, event, *args):
+        """ PropertyGraph listener, see PropertyGraph.subscribe """
+        if event == "add_node":
+            record = node_record(args[0])
+        elif event == "add_relationship":
+            record = edge_record(*args)
+        elif event == "remove_relationship":
+            record = dict(edge_record(*args), type="remove_edge")
+        elif event == "set_property":
+            node, key, value = args
+            record = {"type": "prop", "node": [node.name, node.category], "key": key, "value": value}
+        else:
+            return
+        self._buffer.append(json.dumps(record))
+        if len(self._buffer) >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        """ Write the buffered records to the log in one go """
+        self._write()
+        if self.compact_every and self._logged >= self.compact_every and self.snapshot_path:
+            self.compact()
+
+    def _write(self):
+        if not self._buffer:
+            return
+        self._file.write("\n".join(self._buffer) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._logged += len(self._buffer)
+        self._buffer = []
+
+    def _start(self, generation):
+        """ Empty the log and begin it with a generation record """
+        self._file.truncate(0)
+        self.generation = generation
+        self._buffer = [json.dumps({"type": "generation", "generation": generation})]
+        self._write()
+        self._logged = 0
+
+    def compact(self):
+        """ Save the attached graph as the new snapshot and empty the log.
+        The snapshot records the next log generation, so a crash before the log
+        is emptied leaves a log that open_graph knows the snapshot already holds. """
+        self._write()
+        tmp_path = self.snapshot_path + ".tmp"
+        old_path = self.snapshot_path + ".old"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        save_snapshot(self.graph, tmp_path, self.generation + 1)
+        if os.path.exists(self.snapshot_path):
+            os.replace(self.snapshot_path, old_path)
+        os.replace(tmp_path, self.snapshot_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        self._start(self.generation + 1)
+
+    def close(self):
+        """ Write the buffered records and close the log """
+        self.detach()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def log_generation(path):
+    """ Return the generation of the log at path, None for a missing or empty log.
+    Logs written before generations were recorded are generation 0. """
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        first = f.readline()
+    if not first.strip():
+        return None
+    try:
+        record = json.loads(first)
+    except ValueError:
+        return None
+    return record["generation"] if record["type"] == "generation" else 0
+
+
+def replay(path, graph):
+    """ Apply the records of the log at path to graph, return the number applied.
+    A partly written last line, left by a crash, is ignored. """
+    if not os.path.exists(path):
+        return 0
+    table = NodeTable(graph)
+    count = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record["type"] == "node":
+                graph.add_node(table.node(record["name"], record["category"], record.get("props")))
+            elif record["type"] == "edge":
+                src = table.node(*record["src"])
+                targ = table.node(*record["targ"])
+                graph.add_relationship(src, targ, relationship(record["rel"], record.get("props")))
+            elif record["type"] == "remove_edge":
+                _remove_edge(graph, table, record)
+            elif record["type"] == "prop":
+                table.node(*record["node"])[record["key"]] = record["value"]
+            else:
+                continue
+            count += 1
+    return count
+
+
+def _remove_edge(graph, table, record):
+    """ Remove the first relationship matching a remove_edge record """
+    src = table.node(*record["src"])
+    targ = table.node(*record["targ"])
+    props = record.get("props") or {}
+    for other, rel in graph.propertyGraph[src]:
+        if other == targ and rel.category == record["rel"] and rel._props == props:
+            graph.remove_relationship(src, other, rel)
+            return
+
+
+def open_graph(snapshot_path, log_path, graph_class=None, **options):
+    """ Load the snapshot (if any), replay the log on top of it and return
+    (graph, log) with the log attached to the mutable graph.
+    A log that the snapshot already holds, left by a crash during compact(),
+    is not replayed but emptied. options are passed on to WriteAheadLog """
+    if graph_class is None:
+        from propertygraph import PropertyGraph as graph_class
+    _recover_snapshot(snapshot_path)
+    meta = read_meta(snapshot_path)
+    if meta is not None:
+        graph = graph_class.load(snapshot_path, mmap=False)
+        graph.thaw()
+    else:
+        graph = graph_class()
+
+    covered = meta.get("log_generation", 0) if meta is not None else 0
+    generation = log_generation(log_path)
+    if generation is not None and generation > covered:
+        raise ValueError(f"{log_path} continues generation {generation} "
+                         f"but {snapshot_path} only holds the logs before generation {covered}")
+    if generation is not None and generation < covered:
+        os.remove(log_path)
+    else:
+        replay(log_path, graph)
+    log = WriteAheadLog(log_path, snapshot_path, generation=covered, **options)
+    log.attach(graph)
+    return graph, log
+
+
+def _recover_snapshot(snapshot_path):
+    """ Finish or undo a snapshot swap interrupted by a crash in compact() """
+    tmp_path = snapshot_path + ".tmp"
+    old_path = snapshot_path + ".old"
+    if not os.path.exists(snapshot_path):
+        # the old snapshot was moved aside: a complete new one replaces it,
+        # otherwise the old one is put back and the log still holds the rest
+        if read_meta(tmp_path) is not None:
+            os.replace(tmp_path, snapshot_path)
+        elif os.path.exists(old_path):
+            os.replace(old_path, snapshot_path)
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)